@@ -7,7 +7,23 @@ import threading
 import logging
 import json
 import random
-from datetime import datetime
+import gzip
+import zlib
+import hashlib
+import argparse
+import tempfile
+import socket
+import re
+import signal
+import subprocess
+import csv
+import sqlite3
+import http.client
+import http.server
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from collections import deque
+from datetime import datetime, timedelta
 import tkinter as tk
 from tkinter import ttk
 import smtplib
@@ -17,6 +33,23 @@ from selenium.webdriver.chrome.options import Options as ChromeOptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+# 跨进程文件锁：Windows 使用 msvcrt，其余平台使用 fcntl；Windows 下会话缓存用 DPAPI 加密
+if os.name == 'nt':
+    import msvcrt
+    import ctypes
+    from ctypes import wintypes
+else:
+    import fcntl
+# psutil 为可选依赖：未安装时内存看门狗不可用
+try:
+    import psutil
+except ImportError:
+    psutil = None
+# websocket-client 为可选依赖：未安装时直连 CDP 模式不可用
+try:
+    import websocket
+except ImportError:
+    websocket = None
 
 CONFIG_FILE = 'config.json'
 DEFAULT_SLOTS = [
@@ -27,6 +60,386 @@ DEFAULT_SLOTS = [
 ]
 # 重新登录间隔：3小时（毫秒）
 RELOGIN_INTERVAL = 3 * 60 * 60 * 1000
+# 页面内监听模式下，兜底整页刷新的间隔（秒），防止页内脚本失效后长期读到旧数据
+WATCHER_FULL_REFRESH = 10 * 60
+
+# Chrome 内存看门狗：采样间隔（秒）、增速计算窗口（秒）、RSS 历史文件
+WATCHDOG_SAMPLE_INTERVAL = 60
+WATCHDOG_GROWTH_WINDOW = 30 * 60
+RSS_HISTORY_FILE = os.path.join('logs', 'chrome_rss.csv')
+# 本机所有监控实例共享的令牌桶状态文件（放在系统临时目录，与工作目录无关）
+RATE_BUCKET_FILE = os.path.join(tempfile.gettempdir(), 'neu_monitor_bucket.json')
+# 令牌桶中等待者多久未轮询即视为已退出（秒）；任务多久未出现即不再计入活跃数（秒）
+RATE_WAITER_TTL = 5
+RATE_JOB_TTL = 120
+# 失败退避与熔断：退避基数/上限（秒），连续失败多少次后熔断，熔断后首次探测等待（秒，逐次翻倍）及上限
+BACKOFF_BASE = 2
+BACKOFF_MAX = 60
+BREAKER_THRESHOLD = 5
+BREAKER_OPEN_SECONDS = 30
+BREAKER_OPEN_MAX = 600
+# 定时抢刷：估计服务器时钟偏差的采样次数、放号前多久预先刷新页面并重新对时（秒）、精确等待的自旋时长（秒）
+STRIKE_CLOCK_SAMPLES = 8
+STRIKE_PREPARE = 30
+STRIKE_SPIN = 0.02
+# 预热会话池：保活间隔（秒）、后台维护周期（秒）
+POOL_KEEPALIVE = 5 * 60
+POOL_TICK = 5
+# 预热会话登录失败后的退避上限（秒），避免密码错误或认证服务故障时反复登录导致账号被锁
+POOL_LOGIN_BACKOFF_MAX = 10 * 60
+# 实时看板：环形缓冲长度（检查次数）、重绘节流间隔（毫秒）、热力图单元格尺寸（像素）
+LIVE_HISTORY = 600
+DASHBOARD_TICK_MS = 1000
+HEATMAP_CELL = 14
+# 登录会话缓存文件（Windows 下 DPAPI 加密，其余平台仅当前用户可读）及最长复用时间（秒）
+SESSION_FILE = 'session_cookies.bin'
+# 多账号轮换：连续失败多少次后停用账号、停用多久（秒）后重新登录
+ACCOUNT_RETIRE_FAILURES = 3
+ACCOUNT_COOLDOWN = 30 * 60
+SESSION_MAX_AGE = 7 * 24 * 60 * 60
+# CDP Network.setCookies 接受的 Cookie 字段
+CDP_COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires', 'priority', 'sourceScheme', 'sourcePort')
+# 上次检查的可用状态，重启后继续比对；超过 STATE_MAX_AGE 秒的旧状态不再使用
+STATE_FILE = 'last_state.json'
+STATE_MAX_AGE = 12 * 60 * 60
+# 状态未变化时也每隔这么久（秒）重写一次确认时间，长时间无变化后重启不会误判为过期
+STATE_CONFIRM_INTERVAL = 10 * 60
+# WebDriver 超时：页面加载、脚本执行（秒）；监控线程超过预定时间未报心跳视为卡死（秒）；
+# 看护线程巡检周期（秒）；关闭浏览器的最长等待（秒）；卡死记录文件
+PAGE_LOAD_TIMEOUT = 30
+SCRIPT_TIMEOUT = 15
+STALL_TIMEOUT = 90
+SUPERVISOR_TICK = 5
+QUIT_TIMEOUT = 15
+STALL_HISTORY_FILE = os.path.join('logs', 'stalls.csv')
+# 多机协同：节点心跳/选主周期（秒）、节点与主节点租约有效期（秒）、共享观测多少个间隔未更新视为过期
+CLUSTER_TICK = 2
+CLUSTER_TTL = 10
+CLUSTER_STALE_INTERVALS = 3
+# 通知延迟：滚动窗口大小、直方图分桶（秒）、默认时限（秒）、逐条记录文件
+LATENCY_WINDOW = 200
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300)
+LATENCY_SLA = 60
+LATENCY_HISTORY_FILE = os.path.join('logs', 'notify_latency.csv')
+# 运行中采样分析：采样间隔（秒），输出为 logs/profile_*.folded（折叠栈格式，可直接生成火焰图）
+PROFILE_INTERVAL = 0.01
+# 空档统计表（--analyze 生成，启动时载入用于通知排序）；分析时两次快照间隔超过此值（秒）视为监控中断
+SLOT_STATS_FILE = 'slot_stats.csv'
+ANALYZE_MAX_GAP = 300
+# 多场馆：其他场馆的场地编号为 场馆序号 * VENUE_STRIDE + 场地号（主场馆仍为 1..N），场馆增减不影响已有编号
+VENUE_STRIDE = 100
+# 压力测试：模拟站点每个时段“可用”的概率；容量判定为检查延迟 p90 不超过单任务时的倍数、
+# 错误率和检查速率不低于预期的比例；可用内存低于该比例时停止加压
+SOAK_AVAIL_PROB = 0.02
+SOAK_LATENCY_FACTOR = 2
+SOAK_ERROR_RATE = 0.01
+SOAK_RATE_FLOOR = 0.8
+SOAK_MIN_FREE_MEM = 0.1
+# 页面快照录制目录（压缩、去重，可离线回放）
+RECORD_DIR = 'recordings'
+
+PANEL_XPATH = "//div[contains(@class,'selectList') and contains(@class,'sectionNotes')]"
+
+# 页面内提取全部场地面板的时段文本，与 PANEL_XPATH / TimeDiv//li 的匹配规则一致。
+# 与 Selenium 的 .text 一样，未显示的元素（如其他日期标签页的面板）文本为空
+PANEL_EXTRACT_JS = r"""
+function __neuVisible(el, live) {
+    if (live) { return el.getClientRects().length > 0; }
+    // fetch 得到的文档没有渲染，只能按 hidden 属性和内联 display:none 判断
+    for (; el && el.nodeType === 1; el = el.parentElement) {
+        if (el.hidden || /display\s*:\s*none/i.test(el.getAttribute('style') || '')) { return false; }
+    }
+    return true;
+}
+function __neuExtract(root) {
+    var live = root === document;
+    var pans = root.querySelectorAll('div[class*="selectList"][class*="sectionNotes"]');
+    return Array.prototype.map.call(pans, function (p) {
+        var lis = p.querySelectorAll('div[class*="TimeDiv"] li');
+        return Array.prototype.map.call(lis, function (li) {
+            if (!__neuVisible(li, live)) { return ''; }
+            return (li.innerText || li.textContent || '').replace(/\s+/g, ' ').trim();
+        });
+    });
+}
+"""
+
+# 一次脚本调用读取当前 DOM 中的全部面板
+READ_PANELS_JS = PANEL_EXTRACT_JS + "return __neuExtract(document);"
+# 直连 CDP 时用 Runtime.evaluate 求值的表达式（取最后一个表达式的值）
+READ_PANELS_EXPR = PANEL_EXTRACT_JS + "__neuExtract(document);"
+
+# 场馆目录页：每个预约按钮所在卡片的文字（向上找到文字多于按钮本身的祖先元素）
+VENUE_LIST_JS = r"""
+return Array.prototype.map.call(document.getElementsByClassName('reserve_button'), function (b) {
+    var own = (b.innerText || '').trim(), el = b;
+    while (el.parentElement && (el.innerText || '').trim() === own) { el = el.parentElement; }
+    return (el.innerText || '').replace(own, ' ').replace(/\s+/g, ' ').trim();
+});
+"""
+
+# 页面内监听脚本：DOM 变化时重新提取；Python 每轮刷新时调用 fetchNow 在页内 fetch 当前页面解析面板
+# （由监控线程按轮次驱动，每次拉取都先取得共享限速配额），变化写入缓冲区
+WATCHER_INSTALL_JS = PANEL_EXTRACT_JS + r"""
+if (window.__neuWatcher) { return 'exists'; }
+var w = {seq: 0, key: null, panels: [], ts: 0, checked: 0, events: [], errors: 0, lastError: null, pending: null};
+function update(panels, origin) {
+    w.checked = Date.now();
+    if (!panels.length) { return; }
+    var key = JSON.stringify(panels);
+    if (key === w.key) { return; }
+    w.key = key; w.panels = panels; w.seq += 1; w.ts = w.checked;
+    w.events.push({seq: w.seq, ts: w.ts, origin: origin});
+    if (w.events.length > 200) { w.events.shift(); }
+}
+var pending = null;
+new MutationObserver(function () {
+    if (pending) { return; }
+    pending = setTimeout(function () { pending = null; update(__neuExtract(document), 'dom'); }, 50);
+}).observe(document.body, {childList: true, subtree: true, characterData: true});
+// 返回本次拉取的 Promise；上一次拉取尚未结束时返回同一个 Promise，不重复请求
+function fetchOnce() {
+    if (w.pending) { return w.pending; }
+    w.pending = fetch(location.href, {credentials: 'include', cache: 'no-store'})
+        .then(function (r) {
+            if (!r.ok) { throw new Error('HTTP ' + r.status); }
+            return r.text();
+        })
+        .then(function (html) {
+            var panels = __neuExtract(new DOMParser().parseFromString(html, 'text/html'));
+            // 会话过期跳转到登录页或错误页时没有面板，按失败计，不更新检查时间
+            if (!panels.length) { throw new Error('拉取的页面中没有场地面板（可能已跳转到登录页）'); }
+            update(panels, 'fetch');
+        })
+        .catch(function (e) { w.errors += 1; w.lastError = String(e); })
+        .then(function () { w.pending = null; });
+    return w.pending;
+}
+w.fetchNow = fetchOnce;
+w.drain = function () {
+    var ev = w.events; w.events = [];
+    return {seq: w.seq, ts: w.ts, checked: w.checked, panels: w.panels, events: ev, errors: w.errors, lastError: w.lastError};
+};
+update(__neuExtract(document), 'init');
+window.__neuWatcher = w;
+return 'installed';
+"""
+
+# 页内拉取一次并等待完成（未注入时返回 false）
+WATCHER_FETCH_JS = r"""
+var done = arguments[arguments.length - 1];
+if (!window.__neuWatcher) { done(false); return; }
+window.__neuWatcher.fetchNow().then(function () { done(true); });
+"""
+
+# 取走页内缓冲的变化（未注入时返回 null）
+WATCHER_DRAIN_JS = r"""
+var done = arguments[arguments.length - 1];
+done(window.__neuWatcher ? window.__neuWatcher.drain() : null);
+"""
+
+# 监控线程心跳：每个阶段开始时登记阶段名和允许耗时，看护线程据此判断是否卡死
+class Heartbeat:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage = '启动'
+        self.since = time.time()
+        self.deadline = self.since + STALL_TIMEOUT
+
+    def beat(self, stage, budget=STALL_TIMEOUT):
+        now = time.time()
+        with self.lock:
+            self.stage, self.since, self.deadline = stage, now, now + budget
+
+    # 已超出预定时间则返回 (阶段, 已持续秒数)，否则返回 None
+    def overdue(self):
+        now = time.time()
+        with self.lock:
+            if now <= self.deadline:
+                return None
+            return self.stage, now - self.since
+
+# 采样分析器：后台线程按固定间隔抓取各线程（监控线程、Tk 主线程等；邮件在监控线程内发送）的调用栈，
+# 按“线程;函数 (文件:行);...”累计次数，停止时写出折叠栈文件。不插桩，开销只与采样频率有关，可在运行中随时开关
+class StackSampler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.counts = {}
+        self.samples = 0
+        self.started = time.time()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self.thread.start()
+        logging.info(f'开始采样分析（每 {self.interval * 1000:.0f}ms 采样一次）')
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                key = names.get(ident, str(ident)) + ';' + ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    # 停止并写出折叠栈文件，返回文件路径
+    def stop(self):
+        if not self.running:
+            return None
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        os.makedirs('logs', exist_ok=True)
+        path = os.path.join('logs', f'profile_{datetime.fromtimestamp(self.started).strftime("%Y%m%d_%H%M%S")}.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, n in sorted(self.counts.items()):
+                f.write(f'{key} {n}\n')
+        # 日志里给出各线程最常见的栈顶函数
+        leaves = {}
+        for key, n in self.counts.items():
+            thread, _, rest = key.partition(';')
+            leaf = (thread, rest.rsplit(';', 1)[-1])
+            leaves[leaf] = leaves.get(leaf, 0) + n
+        top = sorted(leaves.items(), key=lambda kv: -kv[1])[:5]
+        logging.info(f'采样分析结束：{time.time() - self.started:.0f}s，{self.samples} 次采样，写入 {path}；'
+                     + '，'.join(f'{t} {leaf} {n / max(self.samples, 1):.0%}' for (t, leaf), n in top))
+        return path
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+# 运行指标（线程安全），状态栏定时读取显示
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, key, n=1):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + n
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+metrics = Metrics()
+
+# 实时看板数据：当前场地×时段状态 + 固定长度的检查延迟/时间环形缓冲，由监控线程写入、Tk 线程读取
+class LiveStats:
+    def __init__(self, maxlen=LIVE_HISTORY):
+        self.lock = threading.Lock()
+        self.grid = {}  # (场地号, 时段) -> 'avail' / 'full'
+        self.latencies = deque(maxlen=maxlen)  # 每次检查的延迟（秒）
+        self.check_times = deque(maxlen=maxlen)  # 每次检查完成的时间
+        self.version = 0
+
+    def record(self, panels, latency):
+        grid = {}
+        for i, texts in enumerate(panels, start=1):
+            for text in texts:
+                for s in DEFAULT_SLOTS:
+                    if s in text:
+                        grid[(i, s)] = 'avail' if '可用' in text else 'full'
+        with self.lock:
+            self.grid = grid
+            self.latencies.append(latency)
+            self.check_times.append(time.time())
+            self.version += 1
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, self.grid, list(self.latencies), list(self.check_times)
+
+live_stats = LiveStats()
+
+# 通知延迟统计：每次通知记录上次未见时间、估计的首次可见时间、读到变化的数据时间、检查完成时间、进入发送时间、
+# 发送完成时间，维护最近若干次“可见 -> 送达”延迟的滚动直方图，超过时限计为超时；逐条追加到 logs/notify_latency.csv。
+# 数据源只给出读取时间，首次可见时间取上次未见与本次读到之间的中点（包含采样间隔带来的延迟）
+class NotifyLatency:
+    def __init__(self, sla=LATENCY_SLA, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.sla = sla
+        self.totals = deque(maxlen=window)
+
+    def record(self, absent_at, visible_at, observed_at, checked_at, queued_at, delivered_at, ok, changes):
+        total = delivered_at - visible_at
+        with self.lock:
+            self.totals.append(total)
+            xs = sorted(self.totals)
+        p50, p90 = xs[len(xs) // 2], xs[int(len(xs) * 0.9)]
+        metrics.set('通知延迟', f'p50 {p50:.1f}s / p90 {p90:.1f}s')
+        if not ok:
+            metrics.inc('通知失败次数')
+        if self.sla and total > self.sla:
+            metrics.inc('通知超时次数')
+            logging.warning(f'通知延迟 {total:.1f}s 超过时限 {self.sla:g}s')
+        logging.info(f'通知延迟：采样 {observed_at - visible_at:.2f}s，检测 {checked_at - observed_at:.2f}s，'
+                     f'排队 {queued_at - checked_at:.2f}s，发送 {delivered_at - queued_at:.2f}s，合计约 {total:.2f}s'
+                     + (f'（范围 {delivered_at - observed_at:.1f}s ~ {delivered_at - absent_at:.1f}s）' if absent_at and visible_at != observed_at else ''))
+        logging.info('通知延迟分布（最近 %d 次）：%s' % (len(xs), '  '.join(f'{label}:{n}' for label, n in self.histogram(xs))))
+        try:
+            new_file = not os.path.exists(LATENCY_HISTORY_FILE)
+            with open(LATENCY_HISTORY_FILE, 'a', encoding='utf-8') as f:
+                if new_file:
+                    f.write('absent_at,visible_at,checked_at,queued_at,delivered_at,total_s,ok,changes,observed_at\n')
+                f.write(f'{f"{absent_at:.3f}" if absent_at else ""},{visible_at:.3f},{checked_at:.3f},{queued_at:.3f},{delivered_at:.3f},'
+                        f'{total:.3f},{int(ok)},{changes},{observed_at:.3f}\n')
+        except OSError as e:
+            logging.warning(f'写入通知延迟记录失败: {e}')
+
+    # 直方图：[(分桶标签, 次数), ...]
+    def histogram(self, xs=None):
+        if xs is None:
+            with self.lock:
+                xs = list(self.totals)
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for x in xs:
+            counts[next((k for k, b in enumerate(LATENCY_BUCKETS) if x <= b), len(LATENCY_BUCKETS))] += 1
+        labels = [f'≤{b}s' for b in LATENCY_BUCKETS] + [f'>{LATENCY_BUCKETS[-1]}s']
+        return list(zip(labels, counts))
+
+notify_latency = NotifyLatency()
+
+# 运行中可热更新的监控参数（场地、时段、间隔、邮件配置）：整体替换，监控线程每轮开始时按版本号取用
+class LiveParams:
+    def __init__(self, params):
+        self.lock = threading.Lock()
+        self.params = dict(params)
+        self.version = 0
+
+    def update(self, **changes):
+        with self.lock:
+            params = dict(self.params)
+            params.update(changes)
+            self.params = params
+            self.version += 1
+
+    def get(self):
+        with self.lock:
+            return self.version, self.params
 
 # 日志处理，将日志写入 Text
 class TextHandler(logging.Handler):
@@ -68,25 +481,76 @@ def send_email(sub, body, server, port, user, pwd, to):
             s.login(user, pwd)
             s.send_message(msg)
         logging.info(f'邮件已发送: {sub}')
+        return True
     except smtplib.SMTPResponseException as e:
         # 部分服务器在发送后断开
         if e.smtp_code < 0:
             logging.warning(f'SMTP 连接断开，邮件可能已发送: {e.smtp_code} - {e.smtp_error}')
-        else:
-            logging.error(f'SMTP 响应错误: {e.smtp_code} - {e.smtp_error}')
+            return True
+        logging.error(f'SMTP 响应错误: {e.smtp_code} - {e.smtp_error}')
     except smtplib.SMTPException as e:
         logging.error(f'SMTP 错误: {e}')
     except Exception as e:
         logging.error(f'发送邮件失败（未知异常）: {e}')
+    return False
+
+# 结束 chromedriver 及其全部 Chrome 子进程（卡死时 quit() 本身也可能阻塞）
+def kill_driver_tree(d):
+    try:
+        pid = d.service.process.pid
+    except Exception:
+        return
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            procs = root.children(recursive=True) + [root]
+        except psutil.NoSuchProcess:
+            return
+        for p in procs:
+            try:
+                p.kill()
+            except psutil.NoSuchProcess:
+                pass
+        psutil.wait_procs(procs, timeout=5)
+    elif os.name == 'nt':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(pid)], capture_output=True, timeout=QUIT_TIMEOUT)
+    else:
+        # 无 psutil 时按进程组结束；chromedriver 与本进程同组时不能整组结束，只能结束 chromedriver 本身
+        try:
+            pgid = os.getpgid(pid)
+        except ProcessLookupError:
+            return
+        if pgid != os.getpgrp():
+            os.killpg(pgid, signal.SIGKILL)
+        else:
+            d.service.process.kill()
+            logging.warning('未安装 psutil，只结束了 chromedriver，Chrome 子进程可能残留（pip install psutil）')
+    logging.warning(f'已强制结束浏览器进程树（chromedriver pid {pid}）')
+
+# 在限定时间内关闭浏览器，超时则强制结束进程树
+def quit_driver(d):
+    t = threading.Thread(target=d.quit, name='driver-quit', daemon=True)
+    t.start()
+    t.join(QUIT_TIMEOUT)
+    if t.is_alive():
+        logging.warning(f'关闭浏览器超过 {QUIT_TIMEOUT}s 未返回')
+        kill_driver_tree(d)
 
 # 浏览器初始化
 def init_driver(debug):
     logging.info('初始化浏览器')
     opt = ChromeOptions()
     opt.add_argument('--disable-blink-features=AutomationControlled')
+    # 多标签页轮流刷新时后台标签不降速
+    opt.add_argument('--disable-background-timer-throttling')
+    opt.add_argument('--disable-renderer-backgrounding')
+    opt.add_argument('--disable-backgrounding-occluded-windows')
     if not debug:
         opt.add_argument('--headless')
     d = webdriver.Chrome(options=opt)
+    # 硬超时：避免页面或脚本卡住时 refresh / execute_script 无限阻塞
+    d.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    d.set_script_timeout(SCRIPT_TIMEOUT)
     # 隐藏自动化痕迹
     try:
         d.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
@@ -97,8 +561,100 @@ def init_driver(debug):
         pass
     return d
 
-# 登录并打开监控面板
-def login_and_open_panel(d, url, user, pwd, verification_code=None):
+# Windows 下用 DPAPI 加密/解密（与当前 Windows 用户绑定），其余平台原样返回
+if os.name == 'nt':
+    class _DataBlob(ctypes.Structure):
+        _fields_ = [('cbData', wintypes.DWORD), ('pbData', ctypes.POINTER(ctypes.c_char))]
+
+    def _dpapi(data, protect):
+        src = _DataBlob(len(data), ctypes.cast(ctypes.create_string_buffer(data, len(data)), ctypes.POINTER(ctypes.c_char)))
+        out = _DataBlob()
+        fn = ctypes.windll.crypt32.CryptProtectData if protect else ctypes.windll.crypt32.CryptUnprotectData
+        if not fn(ctypes.byref(src), None, None, None, None, 0, ctypes.byref(out)):
+            raise ctypes.WinError()
+        try:
+            return ctypes.string_at(out.pbData, out.cbData)
+        finally:
+            ctypes.windll.kernel32.LocalFree(out.pbData)
+
+    def protect_bytes(data):
+        return _dpapi(data, True)
+
+    def unprotect_bytes(data):
+        return _dpapi(data, False)
+else:
+    def protect_bytes(data):
+        return data
+
+    def unprotect_bytes(data):
+        return data
+
+# 保存当前浏览器的全部 Cookie（包括统一认证域名），下次启动可跳过登录
+def save_session(d, user, path=SESSION_FILE):
+    try:
+        cookies = d.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+    except Exception:
+        cookies = d.get_cookies()
+    data = json.dumps({'user': user, 'saved': time.time(), 'cookies': cookies}, ensure_ascii=False).encode('utf-8')
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(protect_bytes(data))
+    os.replace(tmp, path)
+    logging.info(f'已缓存登录会话（{len(cookies)} 个 Cookie）')
+
+# 缓存当前会话（服务器可能在运行中轮换 Cookie），失败只记录警告
+def cache_session(d, user, path=SESSION_FILE):
+    try:
+        save_session(d, user, path)
+    except Exception as e:
+        logging.warning(f'缓存登录会话失败: {e}')
+
+# 用缓存的 Cookie 直接打开面板：一次页面加载即可判断会话是否有效，有效返回 True
+def restore_session(d, url, user, path=SESSION_FILE):
+    try:
+        with open(path, 'rb') as f:
+            cache = json.loads(unprotect_bytes(f.read()).decode('utf-8'))
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logging.warning(f'读取会话缓存失败: {e}')
+        return False
+    if cache.get('user') != user or time.time() - cache.get('saved', 0) > SESSION_MAX_AGE:
+        return False
+    cookies = [{k: c[k] for k in CDP_COOKIE_FIELDS if k in c} for c in cache['cookies']]
+    for c in cookies:
+        # 会话 Cookie 的 expires 为 -1，不能原样写回
+        if c.get('expires', 0) < 0:
+            c.pop('expires')
+    try:
+        d.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+    except Exception as e:
+        logging.warning(f'写入缓存 Cookie 失败: {e}')
+        return False
+    d.get(url)
+    try:
+        # 会话有效时直接出现预约按钮，失效时被重定向到统一认证登录页
+        el = WebDriverWait(d, 10).until(EC.any_of(
+            EC.element_to_be_clickable((By.CLASS_NAME, 'reserve_button')),
+            EC.visibility_of_element_located((By.ID, 'un'))
+        ))
+        if el.get_attribute('id') == 'un':
+            logging.info('缓存会话已失效，执行完整登录')
+            return False
+        el.click()
+        WebDriverWait(d, 10).until(EC.presence_of_all_elements_located((By.XPATH, PANEL_XPATH)))
+    except Exception as e:
+        logging.info(f'缓存会话不可用，执行完整登录: {e}')
+        return False
+    logging.info('使用缓存会话，跳过登录，面板加载完毕')
+    return True
+
+# 登录并打开监控面板（优先复用缓存的会话）
+def login_and_open_panel(d, url, user, pwd, verification_code=None, use_cache=True, session_file=SESSION_FILE):
+    if use_cache and restore_session(d, url, user, session_file):
+        cache_session(d, user, session_file)
+        return
     logging.info('执行登录')
     d.get(url)
     try:
@@ -119,17 +675,1446 @@ def login_and_open_panel(d, url, user, pwd, verification_code=None):
 
         # 等待并进入监控面板
         w.until(EC.element_to_be_clickable((By.CLASS_NAME, 'reserve_button'))).click()
-        w.until(EC.presence_of_all_elements_located((By.XPATH, "//div[contains(@class,'selectList') and contains(@class,'sectionNotes')]")))
+        w.until(EC.presence_of_all_elements_located((By.XPATH, PANEL_XPATH)))
         logging.info('面板加载完毕')
     except Exception:
         logging.error('用户名或密码错误，或者页面未按预期加载，无法访问目标页面')
         raise
+    cache_session(d, user, session_file)
+
+# 轮换账号的会话缓存文件（每个账号一个）
+def account_session_file(user):
+    return f'session_cookies_{hashlib.sha1(user.encode("utf-8")).hexdigest()[:10]}.bin'
+
+# 解析轮换账号配置：“学号:密码;学号:密码”
+def parse_accounts(text):
+    accounts = []
+    for part in text.replace('；', ';').split(';'):
+        user, sep, pwd = part.replace('：', ':', 1).partition(':')
+        if sep and user.strip():
+            accounts.append((user.strip(), pwd))
+    return accounts
+
+# 默认数据源：每轮整页 d.refresh()，再用一次脚本调用读取全部面板
+class WebDriverSource:
+    def __init__(self):
+        self.observed_at = None  # 最近一次读取到的数据对应的时间
+
+    def read_panels(self, d):
+        panels = d.execute_script(READ_PANELS_JS)
+        self.observed_at = time.time()
+        return panels
+
+    def refresh(self, d):
+        d.refresh()
+
+    # 只发起刷新不等待加载（多标签页用）；之后对该标签页的命令由 chromedriver 等待导航完成
+    def start_reload(self, d):
+        d.execute_script('setTimeout(function () { location.reload(); }, 0);')
+
+# 直连 CDP 数据源：通过 Chrome 的 DevTools WebSocket 直接刷新页面（等待 Page.loadEventFired）并用
+# Runtime.evaluate 读取面板，不经过 chromedriver 的 HTTP 转发；登录仍由 Selenium 完成。
+# 同时订阅 Network 事件，主文档返回 4xx/5xx 或加载失败时按失败处理
+class CdpSource:
+    def __init__(self):
+        self.observed_at = None
+        self.ws = None
+        self.driver = None  # 当前连接所属的浏览器，回收/重启后自动重新连接
+        self.msg_id = 0
+        self.doc_status = None
+        self.doc_error = None
+        self.loading = False  # 已发起刷新、尚未收到 load 事件
+
+    def _connect(self, d):
+        self.close()
+        host = d.capabilities['goog:chromeOptions']['debuggerAddress']
+        conn = http.client.HTTPConnection(host, timeout=5)
+        try:
+            conn.request('GET', '/json/list')
+            targets = json.loads(conn.getresponse().read())
+        finally:
+            conn.close()
+        # chromedriver 的窗口句柄即 CDP 的 target id
+        handle = d.current_window_handle
+        pages = [t for t in targets if t.get('type') == 'page']
+        target = next((t for t in pages if t['id'] == handle), pages[0])
+        # 不发送 Origin 头，新版 Chrome 无需 --remote-allow-origins
+        self.ws = websocket.create_connection(target['webSocketDebuggerUrl'], timeout=PAGE_LOAD_TIMEOUT, suppress_origin=True)
+        self.driver = d
+        self.loading = False
+        self._call('Page.enable')
+        self._call('Network.enable')
+        logging.info(f'已直连 CDP（{host}）')
+
+    def _ensure(self, d):
+        if self.ws is None or d is not self.driver:
+            self._connect(d)
+
+    def _recv(self):
+        msg = json.loads(self.ws.recv())
+        method = msg.get('method')
+        if method == 'Network.responseReceived' and msg['params'].get('type') == 'Document':
+            self.doc_status = msg['params']['response']['status']
+        elif method == 'Network.loadingFailed' and msg['params'].get('type') == 'Document':
+            self.doc_error = msg['params'].get('errorText')
+        elif method == 'Page.loadEventFired':
+            self.loading = False
+        return msg
+
+    def _call(self, method, params=None):
+        self.msg_id += 1
+        msg_id = self.msg_id
+        self.ws.send(json.dumps({'id': msg_id, 'method': method, 'params': params or {}}))
+        while True:
+            msg = self._recv()
+            if msg.get('id') == msg_id:
+                if 'error' in msg:
+                    raise RuntimeError(f'{method} 失败: {msg["error"].get("message")}')
+                return msg.get('result', {})
+
+    def _wait_event(self, method):
+        while self._recv().get('method') != method:
+            pass
+
+    # 只发起刷新不等待加载（多标签页用），load 事件在之后的调用中顺带收取
+    def start_reload(self, d):
+        self._ensure(d)
+        self.doc_status = self.doc_error = None
+        self._guard(lambda: self._call('Page.reload'))
+        self.loading = True
+
+    # 等待 start_reload 发起的加载完成，并检查主文档状态
+    def finish_reload(self, d):
+        if self.loading:
+            self._guard(lambda: self._wait_event('Page.loadEventFired'))
+            self.loading = False
+        if self.doc_error:
+            raise RuntimeError(f'页面加载失败: {self.doc_error}')
+        if self.doc_status and self.doc_status >= 400:
+            raise RuntimeError(f'页面返回 HTTP {self.doc_status}')
+
+    # 连接出错后丢弃，下次调用重新连接
+    def _guard(self, fn):
+        try:
+            return fn()
+        except Exception:
+            self.close()
+            raise
+
+    def read_panels(self, d):
+        self._ensure(d)
+        res = self._guard(lambda: self._call('Runtime.evaluate', {'expression': READ_PANELS_EXPR, 'returnByValue': True}))
+        if 'exceptionDetails' in res:
+            raise RuntimeError(f'读取面板脚本出错: {res["exceptionDetails"].get("text")}')
+        self.observed_at = time.time()
+        return res['result'].get('value')
+
+    def refresh(self, d):
+        self.start_reload(d)
+        self.finish_reload(d)
+
+    def close(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+        self.ws = self.driver = None
+
+# 多标签页数据源：在同一个已登录的浏览器中打开 K 个面板标签页（共用 Cookie 与会话）。每轮检查只发起下一个
+# 标签页的刷新、不等待加载，读取的是上一轮发起刷新的标签页，各标签页的加载与其他标签页的读取/等待重叠，
+# 页面加载时间不再限制采样间隔；每个标签页仍按刷新间隔刷新，整体采样间隔约为 间隔 / K
+class TabRotationSource:
+    def __init__(self, url, tabs, source_factory):
+        self.url = url
+        self.tabs = tabs
+        self.factory = source_factory
+        self.driver = None  # 标签页所属的浏览器，回收/重启后重新打开
+        self.handles, self.sources, self.started = [], [], []
+        self.index = 0  # 最近发起刷新的标签页
+        self.read_index = 0  # 下一次读取的标签页
+        self.observed_at = None
+
+    # 关闭旧的多余标签页，再打开 K-1 个新的面板标签页
+    def _open(self, d):
+        main = d.current_window_handle
+        for h in d.window_handles:
+            if h != main:
+                d.switch_to.window(h)
+                d.close()
+        d.switch_to.window(main)
+        self.handles = [main]
+        for k in range(self.tabs - 1):
+            try:
+                d.switch_to.new_window('tab')
+                d.get(self.url)
+                w = WebDriverWait(d, 10)
+                w.until(EC.element_to_be_clickable((By.CLASS_NAME, 'reserve_button'))).click()
+                w.until(EC.presence_of_all_elements_located((By.XPATH, PANEL_XPATH)))
+                self.handles.append(d.current_window_handle)
+            except Exception as e:
+                logging.warning(f'打开第 {k + 2} 个面板标签页失败，使用 {len(self.handles)} 个: {e}')
+                break
+        d.switch_to.window(main)
+        self.driver, self.index, self.read_index = d, 0, 0
+        self.sources = [self.factory() for _ in self.handles]
+        self.started = [time.time()] * len(self.handles)
+        logging.info(f'已打开 {len(self.handles)} 个面板标签页，轮流刷新')
+
+    # 出错后下次调用重新打开全部标签页
+    def _guard(self, fn):
+        try:
+            return fn()
+        except Exception:
+            self.driver = None
+            raise
+
+    @property
+    def fan_out(self):
+        return len(self.handles) or 1
+
+    # 一次 refresh 的页面请求数（共享限速与卡死时限按此计算）：需要重新打开标签页时，
+    # 每个新标签页经目录页点击进入，计两次
+    def requests_per_refresh(self, d):
+        return 2 * (self.tabs - 1) if d is not self.driver else 1
+
+    def refresh(self, d):
+        if d is not self.driver:
+            self._guard(lambda: self._open(d))
+            return
+        # 读取一个间隔槽之前发起刷新的标签页，同时发起下一个标签页的刷新
+        self.read_index = self.index
+        self.index = (self.index + 1) % len(self.handles)
+        source = self.sources[self.index]
+        def run():
+            d.switch_to.window(self.handles[self.index])
+            (getattr(source, 'start_reload', None) or source.refresh)(d)
+        self._guard(run)
+        self.started[self.index] = time.time()
+
+    def read_panels(self, d):
+        if d is not self.driver:
+            # 标签页尚未打开（在下一次 refresh 中打开并计入限速），本轮读取当前标签页
+            panels = d.execute_script(READ_PANELS_JS)
+            self.observed_at = time.time()
+            return panels
+        i = self.read_index
+        source = self.sources[i]
+        def run():
+            d.switch_to.window(self.handles[i])
+            if hasattr(source, 'finish_reload'):
+                source.finish_reload(d)
+            return source.read_panels(d)
+        panels = self._guard(run)
+        # 数据对应该标签页发起刷新的时间
+        self.observed_at = self.started[i]
+        return panels
+
+    # 定时抢刷：同步刷新下一个标签页，并让紧接着的读取读它
+    def refresh_now(self, d):
+        if d is not self.driver:
+            self._guard(lambda: self._open(d))
+        self.index = (self.index + 1) % len(self.handles)
+        source = self.sources[self.index]
+        def run():
+            d.switch_to.window(self.handles[self.index])
+            (getattr(source, 'refresh_now', None) or source.refresh)(d)
+        self._guard(run)
+        self.started[self.index] = time.time()
+        self.read_index = self.index
+
+    def close(self):
+        for source in self.sources:
+            if hasattr(source, 'close'):
+                source.close()
+
+# 多场馆数据源：从场馆目录中按关键字找到其他场馆，记下各自面板页地址并从页面上识别场地数与时段；
+# 每轮在同一个浏览器标签页中依次导航到各场馆（每个场馆一次导航）读取面板，最后回到主场馆。
+# read_panels 返回 主场馆面板 + 各场馆面板 的拼接，venue_courts 给出其他场馆各场地在其中的位置与时段
+class VenueSource:
+    def __init__(self, url, keywords):
+        self.url = url
+        self.keywords = keywords
+        self.driver = None  # 已识别场馆的浏览器，回收/重启后重新识别
+        self.primary_url = url
+        self.venues = []  # [{'name', 'index', 'url', 'slots', 'panels'}]
+        self.venue_courts = {}  # {场地编号: (拼接后的位置, 时段列表)}
+        self.court_labels = {}
+        self.partial = False  # 本轮有场馆未读到（尚未识别或面板为空），监控线程沿用这些场馆的上次状态
+        self.observed_at = None
+
+    # 从目录页点击第 index 个预约按钮进入场馆面板
+    def _enter(self, d, index):
+        d.get(self.url)
+        w = WebDriverWait(d, 10)
+        w.until(EC.element_to_be_clickable((By.CLASS_NAME, 'reserve_button')))
+        d.find_elements(By.CLASS_NAME, 'reserve_button')[index].click()
+        w.until(EC.presence_of_all_elements_located((By.XPATH, PANEL_XPATH)))
+
+    # 打开场馆面板：有独立地址时一次导航，否则经目录页点击进入
+    def _open(self, d, url, index):
+        if url:
+            d.get(url)
+            WebDriverWait(d, 10).until(EC.presence_of_all_elements_located((By.XPATH, PANEL_XPATH)))
+        else:
+            self._enter(d, index)
+
+    def _discover(self, d):
+        d.get(self.url)
+        WebDriverWait(d, 10).until(EC.presence_of_element_located((By.CLASS_NAME, 'reserve_button')))
+        names = d.execute_script(VENUE_LIST_JS)
+        self.venues = []
+        for kw in self.keywords:
+            index = next((k for k, name in enumerate(names) if kw in name and k > 0), None)
+            if index is None:
+                logging.warning(f'场馆目录中没有找到“{kw}”（共 {len(names)} 个场馆）')
+                continue
+            self._enter(d, index)
+            # 点击后地址不变（页内切换）时只能每轮经目录页进入
+            url = d.current_url if d.current_url != self.url else None
+            panels = d.execute_script(READ_PANELS_JS)
+            slots = sorted({m for texts in panels for text in texts for m in re.findall(r'\d{1,2}:\d{2}-\d{1,2}:\d{2}', text)})
+            self.venues.append({'name': names[index][:20], 'index': index, 'url': url, 'slots': slots, 'panels': panels})
+            logging.info(f'场馆“{names[index][:20]}”：{len(panels)} 个场地，{len(slots)} 个时段' + ('' if url else '（无独立地址，每轮经目录页进入）'))
+        # 回到主场馆（第一个预约按钮）
+        self._enter(d, 0)
+        self.primary_url = d.current_url if d.current_url != self.url else None
+        self.driver = d
+
+    def _guard(self, fn):
+        try:
+            return fn()
+        except Exception:
+            self.driver = None
+            raise
+
+    # 在浏览器 d 上一次 refresh 的页面请求数（共享限速按此扣除配额）：无独立地址的场馆需经目录页进入，计两次
+    def requests_per_refresh(self, d):
+        if d is not self.driver:
+            # 识别：目录页 + 每个场馆（目录页 + 点击进入）+ 回到主场馆（目录页 + 点击进入）
+            return 3 + 2 * len(self.keywords)
+        return sum(1 if v['url'] else 2 for v in self.venues) + (1 if self.primary_url or not self.venues else 2)
+
+    def refresh(self, d):
+        if d is not self.driver:
+            self._guard(lambda: self._discover(d))
+            return
+        def scan():
+            for v in self.venues:
+                self._open(d, v['url'], v['index'])
+                v['panels'] = d.execute_script(READ_PANELS_JS)
+                if not v['panels']:
+                    logging.warning(f'场馆“{v["name"]}”本轮没有读到场地面板，沿用上次状态')
+            if self.venues:
+                self._open(d, self.primary_url, 0)
+            else:
+                d.refresh()
+        self._guard(scan)
+
+    def read_panels(self, d):
+        panels = list(d.execute_script(READ_PANELS_JS))
+        if d is not self.driver:
+            # 尚未识别其他场馆（识别在下一次 refresh 中进行并计入限速），本轮只有主场馆
+            self.observed_at = time.time()
+            self.venue_courts, self.court_labels, self.partial = {}, {}, True
+            return panels
+        self.observed_at = time.time()
+        self.partial = any(not v['panels'] for v in self.venues)
+        venue_courts, labels = {}, {}
+        for k, v in enumerate(self.venues, start=1):
+            for j in range(1, len(v['panels']) + 1):
+                key = k * VENUE_STRIDE + j
+                venue_courts[key] = (len(panels) + j - 1, v['slots'])
+                labels[key] = f'{v["name"]} 场地{j}'
+            panels += v['panels']
+        self.venue_courts, self.court_labels = venue_courts, labels
+        return panels
+
+# 页面内监听数据源：注入一次脚本，每轮刷新只在页内拉取一次（不整页刷新），Python 读取缓冲区
+class PageWatcherSource:
+    def __init__(self):
+        self.last_full_refresh = time.time()
+        self.errors = 0
+        self.observed_at = None
+
+    def read_panels(self, d):
+        snap = d.execute_async_script(WATCHER_DRAIN_JS)
+        if snap is None:
+            # 首次或页面被整页刷新后重新注入
+            d.execute_script(WATCHER_INSTALL_JS)
+            logging.info('已注入页面内监听脚本')
+            snap = d.execute_async_script(WATCHER_DRAIN_JS)
+        if snap['events']:
+            origins = ','.join(sorted({e['origin'] for e in snap['events']}))
+            logging.info(f'页面内监听到 {len(snap["events"])} 次变化（来源: {origins}）')
+        if snap['errors'] > self.errors:
+            # 页内拉取失败时缓冲区里是旧数据：按失败处理，并在下一次刷新时整页刷新（重新注入）
+            self.errors = snap['errors']
+            self.last_full_refresh = 0
+            raise RuntimeError(f'页面内拉取失败 {snap["errors"]} 次: {snap["lastError"]}')
+        # 以页内最后一次成功检查（拉取或 DOM 提取）的时间作为数据时间，而不是最后一次变化的时间：
+        # 页面长时间无变化时数据仍是新的（集群据此判断共享观测是否过期）
+        self.observed_at = snap['checked'] / 1000 if snap['checked'] else time.time()
+        return snap['panels']
+
+    # 页内拉取一次并等待完成；尚未注入时由下一次 read_panels 注入并直接读取 DOM。定时抢刷也走这里（不整页刷新）
+    def refresh_now(self, d):
+        d.execute_async_script(WATCHER_FETCH_JS)
+
+    def refresh(self, d):
+        # 页面与会话保持加载；仅按兜底间隔整页刷新一次
+        if time.time() - self.last_full_refresh >= WATCHER_FULL_REFRESH:
+            logging.info('页面内监听：执行兜底整页刷新')
+            d.refresh()
+            self.last_full_refresh = time.time()
+            self.errors = 0
+            return
+        self.refresh_now(d)
+
+# Chrome 内存看门狗：统计 chromedriver 及其 Chrome 子进程树的 RSS/句柄数（Windows 为句柄，其余平台为文件描述符），
+# RSS 或句柄数超过上限、或 RSS 增长过快时建议回收
+class ChromeWatchdog:
+    def __init__(self, limit_mb, growth_mb_per_hour, handle_limit=0):
+        self.limit_mb = limit_mb
+        self.growth_mb_per_hour = growth_mb_per_hour
+        self.handle_limit = handle_limit
+        self.samples = deque(maxlen=WATCHDOG_GROWTH_WINDOW // WATCHDOG_SAMPLE_INTERVAL + 1)  # (时间, RSS MB)
+        self.last_sample = 0.0
+
+    def reset(self):
+        self.samples.clear()
+        self.last_sample = 0.0
+
+    def sample(self, d):
+        root = psutil.Process(d.service.process.pid)
+        procs = [root] + root.children(recursive=True)
+        rss, handles = 0, 0
+        for p in procs:
+            try:
+                rss += p.memory_info().rss
+                handles += p.num_handles() if hasattr(p, 'num_handles') else p.num_fds()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        now = time.time()
+        rss_mb = rss / (1024 * 1024)
+        self.samples.append((now, rss_mb))
+        self.last_sample = now
+        # 保留 RSS 历史以便调参
+        new_file = not os.path.exists(RSS_HISTORY_FILE)
+        with open(RSS_HISTORY_FILE, 'a', encoding='utf-8') as f:
+            if new_file:
+                f.write('time,pid,processes,rss_mb,handles\n')
+            f.write(f'{datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")},{root.pid},{len(procs)},{rss_mb:.1f},{handles}\n')
+        return rss_mb, handles
+
+    # 到采样时间则采样一次；需要回收时返回原因，否则返回 None
+    def check(self, d):
+        if psutil is None or time.time() - self.last_sample < WATCHDOG_SAMPLE_INTERVAL:
+            return None
+        rss_mb, handles = self.sample(d)
+        if self.limit_mb and rss_mb > self.limit_mb:
+            return f'内存 {rss_mb:.0f}MB 超过上限 {self.limit_mb:.0f}MB'
+        if self.handle_limit and handles > self.handle_limit:
+            return f'句柄数 {handles} 超过上限 {self.handle_limit}'
+        t0, rss0 = self.samples[0]
+        # 至少积累 10 分钟样本再计算增速，避免刚启动时的抖动
+        if self.growth_mb_per_hour and self.samples[-1][0] - t0 >= 600:
+            growth = (rss_mb - rss0) / ((self.samples[-1][0] - t0) / 3600)
+            if growth > self.growth_mb_per_hour:
+                return f'内存增速 {growth:.0f}MB/h 超过上限 {self.growth_mb_per_hour:.0f}MB/h'
+        return None
+
+# 刷新/读取失败的指数退避（全抖动）与熔断器：连续失败达到阈值后打开，
+# 等待一段时间后进入半开状态放行一次探测，探测成功则关闭，失败则以更长的等待重新打开
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = '关闭', '打开', '半开'
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 open_seconds=BREAKER_OPEN_SECONDS, open_max=BREAKER_OPEN_MAX):
+        self.threshold = threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.open_seconds = open_seconds
+        self.open_max = open_max
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opens = 0  # 连续打开次数，决定下次打开时长
+        self.retry_at = 0.0
+        metrics.set('熔断器', self.state)
+        metrics.set('连续失败', 0)
+
+    def _transition(self, state):
+        if state != self.state:
+            logging.warning(f'熔断器状态: {self.state} -> {state}')
+            self.state = state
+            metrics.set('熔断器', state)
+
+    # 请求前调用：返回需要等待的秒数，0 表示放行
+    def before_request(self):
+        if self.state != self.OPEN:
+            return 0.0
+        remaining = self.retry_at - time.time()
+        if remaining > 0:
+            return remaining
+        self._transition(self.HALF_OPEN)
+        return 0.0
+
+    def record_success(self):
+        self.failures = 0
+        self.opens = 0
+        metrics.set('连续失败', 0)
+        self._transition(self.CLOSED)
+
+    # 记录一次失败，返回失败后应退避的秒数
+    def record_failure(self, err):
+        self.failures += 1
+        metrics.inc('失败次数')
+        metrics.set('连续失败', self.failures)
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            wait = min(self.open_max, self.open_seconds * (2 ** self.opens))
+            self.opens += 1
+            self.retry_at = time.time() + wait
+            metrics.inc('熔断次数')
+            logging.warning(f'连续失败 {self.failures} 次（{err}），熔断 {wait:.0f}s 后探测')
+            self._transition(self.OPEN)
+            return 0.0
+        if self.state == self.CLOSED:
+            logging.warning(f'第 {self.failures} 次连续失败: {err}')
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (self.failures - 1))))
+
+# 用 HTTP Date 头估计服务器时钟偏差（服务器时间 - 本机时间）。
+# Date 只精确到秒：每个样本把偏差限制在 [D - t1, D + 1 - t0]，多个样本在不同亚秒相位采样后取交集
+def estimate_server_offset(url, samples=STRIKE_CLOCK_SAMPLES):
+    parts = urlsplit(url)
+    lo, hi, mids = float('-inf'), float('inf'), []
+    for k in range(samples):
+        conn_cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        conn = conn_cls(parts.netloc, timeout=5)
+        try:
+            t0 = time.time()
+            conn.request('HEAD', parts.path or '/')
+            resp = conn.getresponse()
+            t1 = time.time()
+            date = resp.getheader('Date')
+        finally:
+            conn.close()
+        if not date:
+            continue
+        server = parsedate_to_datetime(date).timestamp()
+        lo, hi = max(lo, server - t1), min(hi, server + 1 - t0)
+        mids.append(server + 0.5 - (t0 + t1) / 2)
+        # 错开亚秒相位，让样本落在秒边界两侧以收紧区间
+        time.sleep((k + 1) / (samples + 1))
+    if not mids:
+        raise RuntimeError('服务器响应中没有 Date 头，无法对时')
+    if lo <= hi:
+        return (lo + hi) / 2, (hi - lo) / 2
+    # 区间矛盾（网络抖动过大）时退回中位数
+    mids.sort()
+    return mids[len(mids) // 2], 0.5
+
+# 定时抢刷：在每天的放号时间前预先刷新并对时，再按服务器时间精确到毫秒安排一组刷新
+class StrikeScheduler:
+    def __init__(self, url, release_times, shots, spacing_ms, limiter=None):
+        self.url = url
+        self.limiter = limiter  # 对时的 HEAD 请求同样计入共享限速
+        self.release_times = sorted(release_times)
+        self.shots = shots
+        self.spacing = spacing_ms / 1000
+        self.offset, self.error = 0.0, 0.5
+        self.queue = []  # 待执行的 (本机时间, 服务器目标时间, 类型, 序号)
+        self.resync()
+
+    def resync(self, stop_event=None):
+        if self.limiter and not self.limiter.acquire(stop_event or threading.Event(), STRIKE_CLOCK_SAMPLES):
+            return
+        try:
+            self.offset, self.error = estimate_server_offset(self.url)
+            logging.info(f'服务器时钟偏差 {self.offset * 1000:+.0f}ms（±{self.error * 1000:.0f}ms）')
+        except Exception as e:
+            logging.warning(f'估计服务器时钟偏差失败，沿用 {self.offset * 1000:+.0f}ms: {e}')
+
+    def _plan_next(self):
+        server_now = datetime.fromtimestamp(time.time() + self.offset)
+        for day in (0, 1):
+            for t in self.release_times:
+                target = datetime.combine(server_now.date() + timedelta(days=day), t)
+                if target.timestamp() - STRIKE_PREPARE > server_now.timestamp():
+                    ts = target.timestamp()
+                    self.queue = [(ts - STRIKE_PREPARE - self.offset, ts - STRIKE_PREPARE, 'prepare', 0)]
+                    self.queue += [(ts + k * self.spacing - self.offset, ts + k * self.spacing, 'shot', k + 1) for k in range(self.shots)]
+                    return
+
+    # 若下一发在 delay 秒内到期则返回它，否则返回 None
+    def next_shot(self, delay):
+        # 丢弃已错过太久的计划（如期间处于熔断或浏览器重启）
+        while self.queue and self.queue[0][0] < time.time() - 5:
+            self.queue.pop(0)
+        if not self.queue:
+            self._plan_next()
+        if self.queue and self.queue[0][0] <= time.time() + delay:
+            return self.queue.pop(0)
+        return None
+
+    def on_prepare(self, stop_event=None):
+        # 预刷新后重新对时，并按新偏差修正本轮各发的本机时间
+        self.resync(stop_event)
+        self.queue = [(target - self.offset, target, kind, k) for _, target, kind, k in self.queue]
+
+    def log_fired(self, target, k, fired):
+        achieved = (fired + self.offset - target) * 1000
+        metrics.set('抢刷偏差(ms)', round(achieved, 1))
+        logging.info(f'定时抢刷 第{k}/{self.shots}发 {datetime.fromtimestamp(target).strftime("%H:%M:%S.%f")[:-3]}，实际偏差 {achieved:+.1f}ms')
+
+# 精确等待到本机时间 deadline：先粗等，最后 STRIKE_SPIN 秒自旋；收到停止信号返回 True
+def wait_until(deadline, stop_event):
+    remaining = deadline - time.time()
+    if remaining > STRIKE_SPIN and stop_event.wait(remaining - STRIKE_SPIN):
+        return True
+    while time.time() < deadline:
+        pass
+    return stop_event.is_set()
+
+# 解析时段窗口配置，如 "07:30-09:00,11:30-12:30" -> [(time, time), ...]
+def parse_windows(text):
+    windows = []
+    for part in text.replace('，', ',').split(','):
+        if part.strip():
+            start, end = part.strip().split('-')
+            windows.append((datetime.strptime(start.strip(), '%H:%M').time(), datetime.strptime(end.strip(), '%H:%M').time()))
+    return windows
+
+# 解析放号时间配置，如 "12:00:00,20:00" -> [time, ...]（可省略秒）
+def parse_release_times(text):
+    times = []
+    for part in text.replace('，', ',').split(','):
+        part = part.strip()
+        if part:
+            times.append(datetime.strptime(part, '%H:%M:%S' if part.count(':') == 2 else '%H:%M').time())
+    return times
+
+# 解析启动时需要校验的配置项，返回 {配置项: 值}；填写有误时抛出 ValueError 指明是哪一项
+def parse_options(cfg):
+    def positive(text):
+        value = float(text)
+        if value <= 0:
+            raise ValueError
+        return value
+    parsers = {
+        '端口': int,
+        '刷新间隔(s)': positive,
+        '最大重试次数': int,
+        '内存上限(MB)': lambda t: float(t or 0),
+        '内存增速上限(MB/h)': lambda t: float(t or 0),
+        '句柄数上限': lambda t: int(t or 0),
+        '全局每分钟请求上限': lambda t: float(t or 0),
+        '放号时间': parse_release_times,
+        '抢刷次数': lambda t: int(t or 0),
+        '抢刷间隔(ms)': lambda t: float(t or 0),
+        '预热会话数': lambda t: int(t or 0),
+        '预热时段': parse_windows,
+        '标签页数': lambda t: max(1, int(t or 1)),
+        '通知时限(s)': lambda t: float(t or 0),
+    }
+    opts = {}
+    for key, parse in parsers.items():
+        text = str(cfg.get(key, '')).strip()
+        try:
+            opts[key] = parse(text)
+        except ValueError:
+            raise ValueError(f'“{key}”填写有误: {text}')
+    return opts
+
+# 预热会话池：后台保持若干个已登录并停在面板页的浏览器，定期轻刷新保活、失效即补充；
+# 重启/回收时直接取用，省去整套登录流程。配置了时段时只在时段内保持预热。保活刷新同样计入共享限速
+class SessionPool:
+    def __init__(self, size, factory, windows=None, limiter=None):
+        self.size = size
+        self.factory = factory  # 返回一个已登录并打开面板的 driver
+        self.windows = windows or []
+        self.limiter = limiter
+        self.idle = []  # [[driver, 上次保活时间], ...]
+        self.login_failures = 0  # 连续登录失败次数，决定退避时长
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='session-pool', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _target(self):
+        if not self.windows:
+            return self.size
+        now = datetime.now().time()
+        return self.size if any(start <= now <= end for start, end in self.windows) else 0
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            # 多余的和待保活的会话都先移出 idle：保活期间 acquire() 不会把正在刷新的浏览器交出去
+            with self.lock:
+                extra = self.idle[self._target():]
+                self.idle = self.idle[:self._target()]
+                stale = [item for item in self.idle if time.time() - item[1] >= POOL_KEEPALIVE]
+                self.idle = [item for item in self.idle if item not in stale]
+            for item in extra:
+                self._quit(item[0])
+            for item in stale:
+                if self.limiter and not self.limiter.acquire(self.stop_event):
+                    self._quit(item[0])
+                    continue
+                try:
+                    item[0].refresh()
+                    item[1] = time.time()
+                except Exception as e:
+                    logging.warning(f'预热会话保活失败，丢弃: {e}')
+                    self._quit(item[0])
+                    continue
+                with self.lock:
+                    # 保活期间池已关闭则不再放回
+                    if not self.stop_event.is_set():
+                        self.idle.append(item)
+                        item = None
+                if item:
+                    self._quit(item[0])
+            metrics.set('预热会话', len(self.idle))
+            if len(self.idle) < self._target():
+                try:
+                    d = self.factory()
+                except Exception as e:
+                    self.login_failures += 1
+                    wait = min(POOL_LOGIN_BACKOFF_MAX, POOL_TICK * 2 ** self.login_failures)
+                    logging.warning(f'预热会话登录失败（连续 {self.login_failures} 次），{wait:.0f}s 后重试: {e}')
+                    self.stop_event.wait(wait)
+                    continue
+                self.login_failures = 0
+                with self.lock:
+                    self.idle.append([d, time.time()])
+                logging.info(f'预热会话已就绪（{len(self.idle)}/{self.size}）')
+                continue
+            self.stop_event.wait(POOL_TICK)
+
+    # 取一个热会话，没有则返回 None
+    def acquire(self):
+        with self.lock:
+            if not self.idle:
+                return None
+            d = self.idle.pop(0)[0]
+        logging.info('使用预热会话，跳过登录')
+        metrics.inc('预热会话命中')
+        return d
+
+    def close(self):
+        self.stop_event.set()
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for d, _ in idle:
+            self._quit(d)
+
+    @staticmethod
+    def _quit(d):
+        try:
+            d.quit()
+        except Exception:
+            pass
+
+# 轮换中的一个账号：自己的浏览器、数据源、请求预算与健康状况
+class Account:
+    def __init__(self, user, pwd, source, primary=False):
+        self.user = user
+        self.pwd = pwd
+        self.source = source
+        self.primary = primary  # 主账号使用 App 的浏览器，不由轮换器登录/关闭
+        self.driver = None
+        self.next_at = 0.0  # 预算：下一次允许刷新的时间
+        self.failures = 0  # 连续失败次数
+        self.failing_since = 0.0  # 本轮连续失败开始的时间
+        self.last_ok = 0.0  # 最近一次读取成功的时间
+        self.retired_until = 0.0
+        self.checks = 0
+        self.errors = 0
+
+    def active(self, now):
+        return now >= self.retired_until and (self.primary or self.driver is not None)
+
+    # 账号的数据源自身可能并行多个标签页，预算按标签页摊分
+    @property
+    def fan_out(self):
+        return getattr(self.source, 'fan_out', 1)
+
+# 多账号轮换：检查轮流分配给各账号，每个账号最多每个刷新间隔刷新一次（单账号预算不变），
+# 整体采样间隔缩短为 间隔 / 可用账号数。连续失败的账号先重新登录，仍失败则停用一段时间，
+# 冷却后由后台线程重新登录。主账号（界面上的用户名）使用监控线程传入的浏览器
+class AccountRotation:
+    def __init__(self, primary_user, extra_accounts, factory, source_factory, interval):
+        self.factory = factory  # factory(user, pwd) 返回已登录并打开面板的 driver
+        self.interval = interval
+        self.accounts = [Account(primary_user, None, source_factory(), primary=True)]
+        self.accounts += [Account(u, p, source_factory()) for u, p in extra_accounts]
+        self.current = self.accounts[0]
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='account-rotation', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # 后台登录尚无浏览器且不在冷却期的账号
+    def _run(self):
+        while not self.stop_event.is_set():
+            for acc in self.accounts:
+                if self.stop_event.is_set():
+                    return
+                if acc.primary or acc.driver is not None or time.time() < acc.retired_until:
+                    continue
+                try:
+                    d = self.factory(acc.user, acc.pwd)
+                except Exception as e:
+                    logging.warning(f'轮换账号 {acc.user} 登录失败: {e}')
+                    if not self._record_failure(acc):
+                        # 站点可能整体故障：不计入该账号，稍后再试，避免故障期间反复登录
+                        acc.retired_until = time.time() + BACKOFF_MAX
+                    continue
+                with self.lock:
+                    acc.driver, acc.next_at = d, time.time() + self.interval
+                logging.info(f'轮换账号 {acc.user} 已就绪')
+            self._publish()
+            self.stop_event.wait(POOL_TICK)
+
+    def _publish(self):
+        now = time.time()
+        metrics.set('账号', f'{sum(acc.active(now) for acc in self.accounts)}/{len(self.accounts)}')
+
+    # 各账号数据源一次刷新的页面请求数（共享限速用）
+    def requests_per_refresh(self, d):
+        return max(refresh_cost(acc.source, self._driver(acc, d)) for acc in self.accounts)
+
+    # 当前可用的账号数，监控线程据此缩短检查间隔
+    @property
+    def fan_out(self):
+        now = time.time()
+        return max(1, sum(acc.fan_out for acc in self.accounts if acc.active(now)))
+
+    # 选出预算最早到期的可用账号；都不可用时退回主账号
+    def _pick(self):
+        now = time.time()
+        with self.lock:
+            active = [acc for acc in self.accounts if acc.active(now)]
+            return min(active, key=lambda acc: acc.next_at) if active else self.accounts[0]
+
+    def _driver(self, acc, d):
+        return d if acc.primary else acc.driver
+
+    def refresh(self, d):
+        acc = self._pick()
+        self.current = acc
+        # 单账号预算：距上次刷新不足一个间隔时等待到期
+        wait = acc.next_at - time.time()
+        if wait > 0 and self.stop_event.wait(min(wait, self.interval / acc.fan_out)):
+            return
+        acc.next_at = time.time() + self.interval / acc.fan_out
+        acc.source.refresh(self._driver(acc, d))
+
+    def read_panels(self, d):
+        acc = self.current
+        acc.checks += 1
+        try:
+            panels = acc.source.read_panels(self._driver(acc, d))
+            if not panels:
+                raise RuntimeError('页面上没有场地面板')
+        except Exception:
+            self._record_failure(acc)
+            raise
+        acc.failures, acc.failing_since, acc.last_ok = 0, 0.0, time.time()
+        return panels
+
+    @property
+    def observed_at(self):
+        return self.current.source.observed_at
+
+    # 记录一次失败；计入该账号时返回 True。站点整体故障时所有账号都会失败，只有其他账号在该账号
+    # 开始失败之后仍有成功读取（站点正常）才把失败算在该账号上，否则交给熔断器处理
+    def _record_failure(self, acc):
+        acc.errors += 1
+        acc.failing_since = acc.failing_since or time.time()
+        if not any(other.last_ok > acc.failing_since for other in self.accounts if other is not acc):
+            self._publish()
+            return False
+        acc.failures += 1
+        # 首次失败多为会话过期：丢弃浏览器，由后台线程立即重新登录
+        self._drop(acc)
+        if acc.failures >= ACCOUNT_RETIRE_FAILURES:
+            acc.retired_until = time.time() + ACCOUNT_COOLDOWN
+            acc.failures = 0
+            metrics.inc('账号停用次数')
+            logging.warning(f'账号 {acc.user} 连续失败 {ACCOUNT_RETIRE_FAILURES} 次（累计 {acc.errors}/{acc.checks}），'
+                            f'可能已被限制，停用 {ACCOUNT_COOLDOWN // 60} 分钟')
+        self._publish()
+        return True
+
+    def _drop(self, acc):
+        if acc.primary:
+            return
+        with self.lock:
+            old, acc.driver = acc.driver, None
+        if old:
+            threading.Thread(target=quit_driver, args=(old,), daemon=True).start()
+
+    # 卡死恢复：当前账号的浏览器可能已挂起，强制结束并计一次失败
+    def abandon_current(self):
+        acc = self.current
+        if not acc.primary and acc.driver:
+            with self.lock:
+                old, acc.driver = acc.driver, None
+            kill_driver_tree(old)
+        self._record_failure(acc)
+        self.current = self.accounts[0]
+
+    def set_interval(self, interval):
+        self.interval = interval
+        for acc in self.accounts:
+            if hasattr(acc.source, 'set_interval'):
+                acc.source.set_interval(interval)
+
+    def refresh_now(self, d):
+        source = self.current.source
+        (getattr(source, 'refresh_now', None) or source.refresh)(self._driver(self.current, d))
+
+    def close(self):
+        self.stop_event.set()
+        for acc in self.accounts:
+            self._drop(acc)
+
+# 多机协同（共享 SQLite 文件）：各节点登记心跳，租约制选出主节点，主节点按存活节点分配
+# 轮询相位（第 k 个节点只在每 N 个间隔中的第 k 个刷新页面，整个集群的请求量与节点数无关）和场地分区
+# （每个节点只负责自己场地的比对与通知）。页面观测结果写入共享表供其他节点使用；
+# 各场地的“上次状态”也存在共享表中并原子交换，节点接管场地后继续比对，通知不会重复
+class ClusterCoordinator:
+    def __init__(self, db_path, base_interval, courts, node_id=None):
+        self.db_path = db_path
+        self.base_interval = base_interval
+        self.courts = list(courts)
+        self.node_id = node_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.started = time.time()
+        self.phase, self.nodes, self.owned = 0, 1, set(self.courts)
+        self.is_leader = False
+        self.stop_event = threading.Event()
+        db = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, heartbeat REAL, started REAL);
+                CREATE TABLE IF NOT EXISTS leader (id INTEGER PRIMARY KEY CHECK (id = 1), node_id TEXT, expires REAL);
+                CREATE TABLE IF NOT EXISTS assignments (node_id TEXT PRIMARY KEY, phase INTEGER, nodes INTEGER, courts TEXT);
+                CREATE TABLE IF NOT EXISTS observation (id INTEGER PRIMARY KEY CHECK (id = 1), ts REAL, node_id TEXT, panels TEXT);
+                CREATE TABLE IF NOT EXISTS court_state (court INTEGER PRIMARY KEY, state TEXT, ts REAL, node_id TEXT);
+                INSERT OR IGNORE INTO leader VALUES (1, NULL, 0);
+            ''')
+        finally:
+            db.close()
 
-# 持续监测并发送通知（改为使用 driver_getter + stop_event，使得可以安全重启浏览器）
-def monitor_slots(driver_getter, courts, slots, base_interval, max_retry, mail_cfg, stop_event):
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        db.execute('BEGIN IMMEDIATE')
+        return _Tx(db)
+
+    def start(self):
+        threading.Thread(target=self._run, name='cluster', daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            with self._connect() as db:
+                db.execute('DELETE FROM nodes WHERE node_id = ?', (self.node_id,))
+        except sqlite3.Error:
+            pass
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.tick()
+            except sqlite3.Error as e:
+                logging.warning(f'集群协调失败: {e}')
+            self.stop_event.wait(CLUSTER_TICK)
+
+    # 心跳 + 选主 + （主节点）重新分配 + 读取本节点的分配
+    def tick(self):
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)', (self.node_id, now, self.started))
+            db.execute('DELETE FROM nodes WHERE heartbeat < ?', (now - CLUSTER_TTL,))
+            got = db.execute('UPDATE leader SET node_id = ?, expires = ? WHERE id = 1 AND (node_id = ? OR expires < ?)',
+                             (self.node_id, now + CLUSTER_TTL, self.node_id, now)).rowcount
+            if bool(got) != self.is_leader:
+                self.is_leader = bool(got)
+                logging.info(f'集群节点 {self.node_id} {"成为主节点" if got else "不再是主节点"}')
+            if self.is_leader:
+                live = [r[0] for r in db.execute('SELECT node_id FROM nodes ORDER BY started, node_id')]
+                n = len(live)
+                db.execute('DELETE FROM assignments')
+                for k, node in enumerate(live):
+                    db.execute('INSERT INTO assignments VALUES (?, ?, ?, ?)', (node, k, n, json.dumps(self.courts[k::n])))
+            row = db.execute('SELECT phase, nodes, courts FROM assignments WHERE node_id = ?', (self.node_id,)).fetchone()
+        if row:
+            phase, nodes, owned = row[0], row[1], set(json.loads(row[2]))
+            if (phase, nodes, owned) != (self.phase, self.nodes, self.owned):
+                logging.info(f'集群分配更新：相位 {phase}/{nodes}，负责场地 {sorted(owned)}')
+            self.phase, self.nodes, self.owned = phase, nodes, owned
+        metrics.set('集群', f'{self.phase + 1}/{self.nodes}{"*" if self.is_leader else ""}')
+
+    # 当前时间片是否轮到本节点刷新页面
+    def is_my_turn(self):
+        return int(time.time() / self.base_interval) % self.nodes == self.phase
+
+    def owned_courts(self, courts):
+        return [c for c in courts if c in self.owned]
+
+    def publish(self, panels, ts):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO observation VALUES (1, ?, ?, ?)', (ts, self.node_id, json.dumps(panels, ensure_ascii=False)))
+
+    def latest(self):
+        with self._connect() as db:
+            row = db.execute('SELECT ts, panels FROM observation WHERE id = 1').fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    # 原子地用当前状态替换共享的上次状态，返回替换前的状态（用于比对），保证同一变化全集群只通知一次
+    def swap_state(self, curr_state):
+        now = time.time()
+        prev = {}
+        with self._connect() as db:
+            for court, state in curr_state.items():
+                row = db.execute('SELECT state FROM court_state WHERE court = ?', (court,)).fetchone()
+                prev[court] = json.loads(row[0]) if row else []
+                db.execute('INSERT OR REPLACE INTO court_state VALUES (?, ?, ?, ?)', (court, json.dumps(state, ensure_ascii=False), now, self.node_id))
+        return prev
+
+# sqlite3 连接的事务上下文：正常退出提交，异常回滚，最后关闭连接
+class _Tx:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.db.close()
+
+# 集群数据源：只在轮到本节点时刷新页面并发布观测，其余轮次读取其他节点发布的最新观测。
+# 共享限速的配额在本节点实际刷新页面时才扣除（监控线程不再为不刷新的轮次取令牌）
+class ClusterSource:
+    def __init__(self, inner, coord, limiter=None, stop_event=None, heartbeat=None):
+        self.inner = inner
+        self.coord = coord
+        self.limiter = limiter
+        self.stop_event = stop_event or threading.Event()
+        self.heartbeat = heartbeat
+        self.fresh = True  # 页面刚加载/刚由本节点刷新
+        self.observed_at = None
+
+    # 配额由 _fetch 自行扣除
+    def requests_per_refresh(self, d):
+        return 0
+
+    # 取得配额后刷新页面；收到停止信号返回 False
+    def _fetch(self, d):
+        cost = refresh_cost(self.inner, d)
+        if self.limiter and not self.limiter.acquire(self.stop_event, cost):
+            return False
+        if self.heartbeat:
+            self.heartbeat.beat('刷新', STALL_TIMEOUT * max(1, cost))
+        self.inner.refresh(d)
+        return True
+
+    def read_panels(self, d):
+        if not self.fresh:
+            latest = self.coord.latest()
+            if latest and time.time() - latest[0] <= self.coord.base_interval * CLUSTER_STALE_INTERVALS:
+                self.observed_at, panels = latest
+                return panels
+            # 共享观测过期（负责的节点可能已失联），本节点自己刷新读取
+            if not self._fetch(d):
+                raise RuntimeError('收到停止信号')
+        self.fresh = False
+        panels = self.inner.read_panels(d)
+        self.observed_at = self.inner.observed_at
+        if panels:
+            self.coord.publish(panels, self.observed_at)
+        return panels
+
+    def refresh(self, d):
+        if self.coord.is_my_turn() and self._fetch(d):
+            self.fresh = True
+
+    def set_interval(self, interval):
+        self.coord.base_interval = interval
+        if hasattr(self.inner, 'set_interval'):
+            self.inner.set_interval(interval)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+# 跨进程文件锁（上下文管理器），锁住 path + '.lock'
+class FileLock:
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, 'a+')
+        if os.name == 'nt':
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if os.name == 'nt':
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.f.close()
+
+# 本机共享令牌桶：所有监控实例刷新前都要取一个令牌，全局速率不超过 rate_per_min；
+# 等待中的任务按先来先得排队，保证多个任务之间公平分配
+class SharedTokenBucket:
+    def __init__(self, rate_per_min, job_id, path=RATE_BUCKET_FILE):
+        self.rate = rate_per_min / 60.0
+        self.capacity = max(1.0, rate_per_min / 10.0)  # 允许的最大突发
+        self.job_id = job_id
+        self.path = path
+
+    def _load(self, now):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'tokens': self.capacity, 'ts': now, 'jobs': {}}
+
+    def _save(self, state):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    # 尝试取一个令牌：成功返回 0，否则返回建议等待的秒数
+    def try_acquire(self):
+        with FileLock(self.path):
+            now = time.time()
+            state = self._load(now)
+            state['tokens'] = min(self.capacity, state['tokens'] + max(0.0, now - state['ts']) * self.rate)
+            state['ts'] = now
+            jobs = state['jobs']
+            for jid in list(jobs):
+                j = jobs[jid]
+                if now - j['seen'] > RATE_JOB_TTL or (j['waiting'] and now - j['seen'] > RATE_WAITER_TTL):
+                    del jobs[jid]
+            me = jobs.setdefault(self.job_id, {'seen': now, 'waiting': None, 'granted': 0})
+            me['seen'] = now
+            if me['waiting'] is None:
+                me['waiting'] = now
+            first = min((j['waiting'], jid) for jid, j in jobs.items() if j['waiting'] is not None)[1]
+            if state['tokens'] >= 1 and first == self.job_id:
+                state['tokens'] -= 1
+                me['waiting'] = None
+                me['granted'] += 1
+                wait = 0.0
+            else:
+                waiters = sum(1 for j in jobs.values() if j['waiting'] is not None)
+                wait = max(0.05, (1 - state['tokens']) / self.rate) if first == self.job_id else min(1.0, waiters / self.rate)
+            self._save(state)
+            return wait
+
+    # 阻塞直到取得令牌；等待期间收到停止信号则返回 False
+    # 取 n 个令牌（一次刷新包含多次页面请求时）
+    def acquire(self, stop_event, n=1):
+        if n <= 0:
+            return True
+        start = time.time()
+        while not stop_event.is_set():
+            wait = self.try_acquire()
+            if wait == 0:
+                n -= 1
+                if n > 0:
+                    continue
+                if time.time() - start > 1:
+                    logging.info(f'共享限速：等待 {time.time() - start:.1f}s 后获得请求配额')
+                return True
+            time.sleep(min(wait, 0.5))
+        return False
+
+# 页面快照录制：gzip 追加写 JSON 行，相同内容只存一次（{"h","panels"}），每次检查只记一行 {"t","h"}
+class SnapshotRecorder:
+    def __init__(self, directory=RECORD_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{datetime.now().strftime("%Y%m%d_%H%M%S")}.jsonl.gz')
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.f = gzip.open(self.path, 'at', encoding='utf-8')
+        logging.info(f'页面快照录制到 {self.path}')
+
+    def record(self, panels, ts):
+        data = json.dumps(panels, ensure_ascii=False, separators=(',', ':'))
+        h = hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+        with self.lock:
+            if h not in self.seen:
+                self.seen.add(h)
+                self.f.write(f'{{"h":"{h}","panels":{data}}}\n')
+            self.f.write(f'{{"t":{ts:.3f},"h":"{h}"}}\n')
+            # 同步刷新，进程异常退出时已写内容仍可读取
+            self.f.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+# 录制包装：读取照常走内部数据源，顺带写入录制文件
+class RecordingSource:
+    def __init__(self, inner, recorder):
+        self.inner = inner
+        self.recorder = recorder
+        self.observed_at = None
+
+    def read_panels(self, d):
+        panels = self.inner.read_panels(d)
+        self.observed_at = self.inner.observed_at
+        self.recorder.record(panels, self.observed_at)
+        return panels
+
+    def refresh(self, d):
+        self.inner.refresh(d)
+
+    # 其余能力（refresh_now / set_interval 等）转交内部数据源
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+# 读取录制文件，按顺序产出 (时间戳, 面板快照, 内容哈希)
+def load_recording(path):
+    blobs = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        while True:
+            try:
+                line = f.readline()
+            except (EOFError, zlib.error):
+                # 未关闭的文件（仍在录制、进程被结束或卡死重启）没有 gzip 结束标记，读到这里即为末尾
+                break
+            if not line:
+                break
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # 末尾可能是未写完的行
+                break
+            if 'panels' in rec:
+                blobs[rec['h']] = rec['panels']
+            else:
+                yield rec['t'], blobs[rec['h']], rec['h']
+
+# 回放数据源：每次 refresh 前进到下一个快照，全部回放完后置位 stop_event
+class ReplaySource:
+    def __init__(self, paths, stop_event):
+        self.records = (rec for p in paths for rec in load_recording(p))
+        self.stop_event = stop_event
+        self.count = 0
+        self.observed_at, self.panels = None, []
+        self.refresh(None)
+
+    def read_panels(self, d):
+        return self.panels
+
+    def refresh(self, d):
+        try:
+            self.observed_at, self.panels, _ = next(self.records)
+            self.count += 1
+        except StopIteration:
+            self.stop_event.set()
+
+# 按选中的场地/时段筛选可用时段：dict {场地号: [可用时段文本, ...]}
+def build_state(panels, courts, slots):
+    curr_state = {}
+    for i in courts:
+        available_list = []
+        if i-1 < len(panels):
+            for text in panels[i-1]:
+                if any(s in text and '可用' in text for s in slots):
+                    available_list.append(text)
+        curr_state[i] = available_list
+    return curr_state
+
+# 其他场馆的当前状态：使用各场馆页面上识别出的全部时段
+def build_venue_state(panels, venue_courts):
+    state = {}
+    for key, (pos, slots) in venue_courts.items():
+        texts = panels[pos] if pos < len(panels) else []
+        state[key] = [text for text in texts if '可用' in text and any(s in text for s in slots)]
+    return state
+
+# 计算变化：首次检查（prev_state is None）强制通知；否则比对每个场地新增/取消
+def diff_states(prev_state, curr_state, overall_current):
+    notify = False
+    changes = []  # 存放 (场地号, added_set, removed_set)
+    if prev_state is None:
+        # 修改：首次检查如果全站点无可用则不发送通知（避免每次启动时收到“无变化/无可用”邮件）
+        if overall_current:
+            notify = True
+            for i, cur in curr_state.items():
+                added = set(cur)
+                removed = set()
+                if added:
+                    changes.append((i, added, removed))
+        else:
+            logging.info('首次检查：无可用时段，跳过首次通知')
+    else:
+        for i, cur in curr_state.items():
+            prev_set = set(prev_state.get(i, []))
+            curr_set = set(cur)
+            added = curr_set - prev_set
+            removed = prev_set - curr_set
+            if added or removed:
+                notify = True
+                changes.append((i, added, removed))
+    return notify, changes
+
+# 读取持久化的上次状态：dict {场地号: [可用时段文本, ...]}，不存在或过期返回 None
+def load_last_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f'读取上次状态失败: {e}')
+        return None
+    age = time.time() - saved['ts']
+    if age > STATE_MAX_AGE:
+        logging.info(f'上次状态已过期（{age / 3600:.1f} 小时前），按首次检查处理')
+        return None
+    logging.info(f'载入上次状态（{age / 60:.1f} 分钟前），继续比对变化')
+    return {int(k): v for k, v in saved['state'].items()}
+
+# 状态变化时写入磁盘（先写临时文件再替换，避免中途退出留下半个文件）
+def save_last_state(path, state, ts):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'ts': ts, 'state': state}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+# 载入空档统计表：dict {(场地号, 时段, 星期): (每天出现次数, 开放时长中位数秒)}，不存在返回 None
+def load_slot_stats(path=SLOT_STATS_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            stats = {(int(r['court']), r['slot'], int(r['weekday'])): (float(r['per_day']), float(r['open_s_median']))
+                     for r in csv.DictReader(f)}
+    except FileNotFoundError:
+        return None
+    except (KeyError, ValueError, csv.Error) as e:
+        logging.warning(f'空档统计文件 {path} 格式错误，忽略: {e}')
+        return None
+    logging.info(f'已载入空档统计 {path}（{len(stats)} 条），通知按历史出现频率排序')
+    return stats
+
+# 按统计表给新增时段打分：返回 (每天出现次数, 开放时长中位数秒)，无记录为 (0, 0)
+def slot_score(slot_stats, court, text, weekday):
+    for s in DEFAULT_SLOTS:
+        if s in text:
+            return slot_stats.get((court, s, weekday), (0.0, 0.0))
+    return (0.0, 0.0)
+
+# 生成通知邮件正文（上：每个场地的新增/取消，下：当前全部可用总览）；
+# 有空档统计时，按历史出现频率把“少见”的空档排在前面并附上历史数据
+def build_mail_body(changes, overall_current, slot_stats=None, labels=None):
+    if not changes:
+        return '<html><body><h3>场地状态检查（无变化/无可用）</h3></body></html>'
+    weekday = datetime.now().weekday()
+    # 空档统计只覆盖主场馆的场地；其他场馆没有历史数据，不做排序和“少见”提示
+    known = set(range(1, VENUE_STRIDE)) if slot_stats else set()
+    if slot_stats:
+        def rarity(change):
+            scores = [slot_score(slot_stats, change[0], a, weekday)[0] for a in change[1]] if change[0] in known else []
+            return min(scores) if scores else float('inf')
+        changes = sorted(changes, key=rarity)
+    body = '<html><body>'
+    body += '<h3>场地变更详情（上：每个场地的新增/取消，下：当前全部可用总览）</h3>'
+    # 列出每个发生变化的场地（左：新增；同时显示取消）
+    for i, added, removed in changes:
+        body += f'<div><strong>{(labels or {}).get(i, f"场地 {i}")}</strong></div>'
+        # 新增
+        if added:
+            body += '<div>新增：<ul>'
+            for a in sorted(added):
+                if i in known:
+                    per_day, open_s = slot_score(slot_stats, i, a, weekday)
+                    hint = f'（历史：每天出现 {per_day:.1f} 次，通常开放 {open_s / 60:.1f} 分钟）' if per_day else '（历史上少见）'
+                    body += f'<li>{a} {hint}</li>'
+                else:
+                    body += f'<li>{a}</li>'
+            body += '</ul></div>'
+        else:
+            body += '<div>新增：—</div>'
+        # 取消（若有）
+        if removed:
+            body += '<div>取消：<ul>'
+            for r in sorted(removed):
+                body += f'<li>{r}</li>'
+            body += '</ul></div>'
+    # 分隔并输出一次性全站点总览（右列现在只输出一次在这里）
+    body += '<hr/>'
+    body += '<h3>当前全部可用（全站点总览）</h3>'
+    if overall_current:
+        body += '<ul>'
+        for oc in sorted(overall_current):
+            body += f'<li>{oc}</li>'
+        body += '</ul>'
+    else:
+        body += '<div>无</div>'
+    body += '</body></html>'
+    return body
+
+# 数据源在浏览器 d 上一次刷新的页面请求数：共享限速按此扣除配额，卡死判定的时限也按此放宽
+def refresh_cost(source, d):
+    cost = getattr(source, 'requests_per_refresh', None)
+    return cost(d) if cost else 1
+
+# 持续监测并发送通知（driver_getter + stop_event 使得可以安全重启浏览器；source 决定如何刷新/读取页面）
+def monitor_slots(driver_getter, courts, slots, base_interval, max_retry, mail_cfg, stop_event, source=None, notifier=send_email, between_checks=None, limiter=None, breaker=None, strike=None, stats=None, live_params=None, state_file=None, heartbeat=None, cluster=None, slot_stats=None, latency=None):
+    source = source or WebDriverSource()
+    breaker = breaker or CircuitBreaker()
+    heartbeat = heartbeat or Heartbeat()
+    params_version = 0
     retry = 0
-    prev_state = None  # None 表示首次检查
+    last_refresh_at = None  # 最近一次发起刷新的时间，用于计算检查延迟
+    prev_observed_at = None  # 上一次成功检查的数据时间（新增时段在此时仍不可见）
+    prev_state = load_last_state(state_file) if state_file else None  # None 表示首次检查
+    state_saved_at = 0.0  # 最近一次写入状态文件的时间
     while not stop_event.is_set():
+        # 熔断打开期间不发请求，等到探测时间
+        wait = breaker.before_request()
+        if wait > 0:
+            heartbeat.beat('熔断等待', wait + STALL_TIMEOUT)
+            stop_event.wait(wait)
+            continue
+        heartbeat.beat('检查')
+
+        # 运行中修改的配置在每轮开始时整体生效，浏览器与会话不受影响
+        if live_params:
+            version, p = live_params.get()
+            if version != params_version:
+                params_version = version
+                courts, slots, base_interval, mail_cfg = p['courts'], p['slots'], p['base_interval'], p['mail_cfg']
+                if hasattr(source, 'set_interval'):
+                    source.set_interval(base_interval)
+                logging.info(f'已应用新配置：场地 {courts}，时段 {slots}，间隔 {base_interval}s，收件 {mail_cfg[4]}')
+
         retry += 1
         logging.info(f'第{retry}次检查')
         d = driver_getter()
@@ -138,121 +2123,180 @@ def monitor_slots(driver_getter, courts, slots, base_interval, max_retry, mail_c
             time.sleep(1)
             continue
 
+        # 半开探测：先刷新再读取，否则读到的仍是故障时的旧页面
+        if breaker.state == breaker.HALF_OPEN:
+            cost = refresh_cost(source, d)
+            if limiter and not limiter.acquire(stop_event, cost):
+                break
+            heartbeat.beat('刷新', STALL_TIMEOUT * max(1, cost))
+            last_refresh_at = time.time()
+            try:
+                source.refresh(d)
+            except Exception as e:
+                breaker.record_failure(f'刷新页面失败: {e}')
+                continue
+
+        read_start = time.time()
         try:
-            pans = d.find_elements(By.XPATH, "//div[contains(@class,'selectList') and contains(@class,'sectionNotes')]")
+            panels = source.read_panels(d)
+            # 站点故障时页面能加载但没有场地面板，同样按失败处理，避免误报全部“取消”
+            if not panels:
+                raise RuntimeError('页面上没有场地面板')
         except Exception as e:
-            logging.warning(f'获取页面元素失败（可能是浏览器已重启或连接断开）: {e}')
-            # 等待短时间，进入下一循环以便重试或等待 restart 完成
-            time.sleep(2)
+            # 指数退避后刷新重试（可能是浏览器已重启、连接断开或站点故障）
+            backoff = breaker.record_failure(f'获取页面元素失败: {e}')
+            heartbeat.beat('退避重试', backoff + STALL_TIMEOUT)
+            if stop_event.wait(backoff):
+                break
+            cost = refresh_cost(source, d)
+            if breaker.before_request() == 0 and (limiter is None or limiter.acquire(stop_event, cost)):
+                heartbeat.beat('刷新', STALL_TIMEOUT * max(1, cost))
+                try:
+                    source.refresh(d)
+                except Exception:
+                    pass
             continue
+        checked_at = time.time()
+        observed_at = source.observed_at or checked_at
+        breaker.record_success()
+        metrics.inc('检查次数')
+        if stats:
+            stats.record(panels, time.time() - (last_refresh_at or read_start))
+        last_refresh_at = None
 
-        # 构建当前状态：dict {场地号: [可用时段文本, ...]}
-        curr_state = {}
-        for i in courts:
-            available_list = []
-            if i-1 < len(pans):
-                lis = pans[i-1].find_elements(By.XPATH, ".//div[contains(@class,'TimeDiv')]//li")
-                for el in lis:
-                    text = el.text.strip()
-                    if any(s in text and '可用' in text for s in slots):
-                        available_list.append(text)
-            curr_state[i] = available_list
+        # 集群模式下只比对/通知本节点负责的场地，上次状态取自共享表
+        curr_state = build_state(panels, cluster.owned_courts(courts) if cluster else courts, slots)
+        # 多场馆：其他场馆按页面识别出的场地/时段比对（集群模式下由共享状态的原子交换去重）
+        venue_courts = getattr(source, 'venue_courts', None)
+        if venue_courts:
+            curr_state.update(build_venue_state(panels, venue_courts))
+        if getattr(source, 'partial', False) and prev_state and not cluster:
+            # 本轮未读到的场馆（重启后尚未识别、或页面为空）沿用上次状态，下次读到时不会重复通知；
+            # 集群模式下共享表只替换本轮读到的场地，无需处理
+            for key, state in prev_state.items():
+                if key >= VENUE_STRIDE and key not in curr_state:
+                    curr_state[key] = state
+        labels = getattr(source, 'court_labels', None)
+        if cluster:
+            try:
+                prev_state = cluster.swap_state(curr_state)
+            except sqlite3.Error as e:
+                logging.warning(f'读取集群共享状态失败，本轮跳过通知: {e}')
+                prev_state = curr_state
 
         # 构建全局当前可用列表（底部显示一次）：格式为 "场地X: 时段文本"
         overall_current = []
         for i, cur in curr_state.items():
             for c in cur:
-                overall_current.append(f'场地{i}: {c}')
-
-        # 计算变化：首次检查（prev_state is None）强制通知；否则比对每个场地新增/取消
-        notify = False
-        changes = []  # 存放 (场地号, added_set, removed_set)
-        if prev_state is None:
-            # 修改：首次检查如果全站点无可用则不发送通知（避免每次启动时收到“无变化/无可用”邮件）
-            if overall_current:
-                notify = True
-                for i, cur in curr_state.items():
-                    added = set(cur)
-                    removed = set()
-                    if added:
-                        changes.append((i, added, removed))
-            else:
-                logging.info('首次检查：无可用时段，跳过首次通知')
-        else:
-            for i, cur in curr_state.items():
-                prev_set = set(prev_state.get(i, []))
-                curr_set = set(cur)
-                added = curr_set - prev_set
-                removed = prev_set - curr_set
-                if added or removed:
-                    notify = True
-                    changes.append((i, added, removed))
+                overall_current.append(f'{(labels or {}).get(i, f"场地{i}")}: {c}')
+
+        notify, changes = diff_states(prev_state, curr_state, overall_current)
 
         # 发送邮件（若需要）
         if notify:
-            subject = f'NEU场地状态更新 - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
-            if not changes:
-                body = '<html><body><h3>场地状态检查（无变化/无可用）</h3></body></html>'
-            else:
-                body = '<html><body>'
-                body += '<h3>场地变更详情（上：每个场地的新增/取消，下：当前全部可用总览）</h3>'
-                # 列出每个发生变化的场地（左：新增；同时显示取消）
-                for i, added, removed in changes:
-                    body += f'<div><strong>场地 {i}</strong></div>'
-                    # 新增
-                    if added:
-                        body += '<div>新增：<ul>'
-                        for a in sorted(added):
-                            body += f'<li>{a}</li>'
-                        body += '</ul></div>'
-                    else:
-                        body += '<div>新增：—</div>'
-                    # 取消（若有）
-                    if removed:
-                        body += '<div>取消：<ul>'
-                        for r in sorted(removed):
-                            body += f'<li>{r}</li>'
-                        body += '</ul></div>'
-                # 分隔并输出一次性全站点总览（右列现在只输出一次在这里）
-                body += '<hr/>'
-                body += '<h3>当前全部可用（全站点总览）</h3>'
-                if overall_current:
-                    body += '<ul>'
-                    for oc in sorted(overall_current):
-                        body += f'<li>{oc}</li>'
-                    body += '</ul>'
-                else:
-                    body += '<div>无</div>'
-                body += '</body></html>'
-
+            subject = f'NEU场地状态更新 - {datetime.fromtimestamp(observed_at).strftime("%Y-%m-%d %H:%M:%S")}'
+            body = build_mail_body(changes, overall_current, slot_stats, labels)
+            queued_at = time.time()
             try:
-                send_email(subject, body, *mail_cfg)
+                # 通知渠道返回 False 表示发送失败（send_email 内部已记录原因）
+                ok = notifier(subject, body, *mail_cfg) is not False
                 logging.info('检测到变化，已发送通知')
             except Exception as e:
+                ok = False
                 logging.error(f'发送通知失败: {e}')
+            if latency:
+                # 数据源只有读取时间：首次可见时间取与上次检查的中点
+                visible_at = observed_at if prev_observed_at is None else (prev_observed_at + observed_at) / 2
+                latency.record(prev_observed_at, visible_at, observed_at, checked_at, queued_at, time.time(), ok,
+                               sum(len(added) for _, added, _ in changes))
         else:
             logging.info('本轮未检测到场地可用时段变化，无需通知')
 
-        # 更新前一状态
+        # 更新前一状态（有变化时持久化，无变化时定期刷新确认时间，重启后继续比对）
+        if state_file and (curr_state != prev_state or time.time() - state_saved_at >= STATE_CONFIRM_INTERVAL):
+            try:
+                save_last_state(state_file, curr_state, time.time())
+                state_saved_at = time.time()
+            except Exception as e:
+                logging.warning(f'保存状态失败: {e}')
         prev_state = curr_state
+        prev_observed_at = observed_at
+
+        # 两次检查之间的空闲时机（如内存回收），可能替换浏览器
+        if between_checks:
+            # 可能包含重新登录，放宽时限
+            heartbeat.beat('检查间隙', STALL_TIMEOUT * 3)
+            try:
+                between_checks(d)
+            except Exception as e:
+                logging.warning(f'检查间隙任务失败: {e}')
+            d = driver_getter() or d
 
         # 随机延迟，防止固定频率被识别
-        delay = base_interval * random.uniform(0.8, 1.2)
+        # 多账号轮换时按可用账号数缩短间隔（单账号的预算由数据源保证）
+        delay = base_interval * random.uniform(0.8, 1.2) / getattr(source, 'fan_out', 1)
+
+        # 定时抢刷：放号时间附近改为按计划精确刷新
+        shot = strike.next_shot(delay) if strike else None
+        if shot:
+            shot_at, target, kind, k = shot
+            cost = refresh_cost(source, d)
+            heartbeat.beat('定时抢刷', max(0.0, shot_at - time.time()) + STALL_TIMEOUT * (1 + max(1, cost)))
+            # 提前取得限速令牌，避免在放号瞬间排队
+            if limiter and not limiter.acquire(stop_event, cost):
+                logging.info('检测线程收到停止信号，退出循环')
+                return
+            if wait_until(shot_at, stop_event):
+                logging.info('检测线程收到停止信号，退出循环')
+                return
+            fired = last_refresh_at = time.time()
+            try:
+                if kind == 'shot':
+                    (getattr(source, 'refresh_now', None) or source.refresh)(d)
+                    strike.log_fired(target, k, fired)
+                else:
+                    logging.info('定时抢刷：放号前预刷新页面')
+                    source.refresh(d)
+                    strike.on_prepare(stop_event)
+            except Exception as e:
+                breaker.record_failure(f'刷新页面失败: {e}')
+            continue
+
         logging.info(f'延迟{delay:.2f}s后继续监测')
+        heartbeat.beat('等待', delay + STALL_TIMEOUT)
 
-        # 在等待过程中也要响应 stop_event
+        # 在等待过程中也要响应 stop_event；等待中修改了刷新间隔时按新间隔重新计算本次等待
         slept = 0.0
+        waited_version = params_version
         while slept < delay:
             if stop_event.is_set():
                 logging.info('检测线程收到停止信号，退出循环')
                 return
+            if live_params:
+                version, p = live_params.get()
+                if version != waited_version:
+                    waited_version = version
+                    delay = slept + p['base_interval'] * random.uniform(0.8, 1.2) / getattr(source, 'fan_out', 1)
+                    heartbeat.beat('等待', delay - slept + STALL_TIMEOUT)
+                    if slept >= delay:
+                        break
             time.sleep(min(1.0, delay - slept))
             slept += min(1.0, delay - slept)
 
+        # 本机共享限速：取到令牌后才发起请求；一次刷新包含多次页面导航时按导航数放宽卡死时限
+        cost = refresh_cost(source, d)
+        if limiter:
+            heartbeat.beat('限速排队', STALL_TIMEOUT * 2)
+            if not limiter.acquire(stop_event, cost):
+                logging.info('检测线程收到停止信号，退出循环')
+                return
+
+        heartbeat.beat('刷新', STALL_TIMEOUT * max(1, cost))
+        last_refresh_at = time.time()
         try:
-            d.refresh()
+            source.refresh(d)
         except Exception as e:
-            logging.warning(f'刷新页面失败: {e}')
+            breaker.record_failure(f'刷新页面失败: {e}')
 
         if retry >= max_retry:
             retry = 0
@@ -278,7 +2322,21 @@ class App(tk.Tk):
         self._stop_event = threading.Event()  # 用于控制监控线程停止/重启
         self.monitor_thread = None
         self.monitor_params = None  # 存放当前监控线程使用的参数，以便重启时复用
+        self.recorder = None  # 页面快照录制器（跨重启复用同一文件）
+        self.watchdog = None  # Chrome 内存看门狗
+        self.limiter = None  # 本机跨进程共享限速
+        self.strike = None  # 放号时间定时抢刷
+        self.pool = None  # 预热会话池
+        self.rotation = None  # 多账号轮换
+        self.sampler = StackSampler()  # 运行中采样分析（按钮或信号开关）
+        self.live_params = None  # 运行中可热更新的监控参数
+        self.heartbeat = Heartbeat()  # 当前监控线程的心跳（每个线程一个，旧线程醒来不会影响新线程）
+        self._restart_lock = threading.Lock()  # 自动重登录与卡死恢复互斥
+        self.supervisor = None
+        self.cluster = None  # 多机协同
+        self.slot_stats = None  # 空档统计（可选），日志初始化后载入
         self.build_ui()
+        self.slot_stats = load_slot_stats()
         self.protocol('WM_DELETE_WINDOW', self.on_close)
 
     def save_and_log_change(self, key, value):
@@ -301,6 +2359,7 @@ class App(tk.Tk):
         main.columnconfigure(1, weight=1)
 
         self.config_widgets = []
+        self.hot_widgets = []  # 运行中仍可修改、点击“应用配置”即时生效的控件
         # 登录配置
         ttk.Label(main, text='登录 URL').grid(row=0, column=0, sticky='e')
         ttk.Label(main, text='http://book.neu.edu.cn/booking/page/selectPeList').grid(row=0, column=1, sticky='w')
@@ -327,6 +2386,7 @@ class App(tk.Tk):
             cb.grid(row=(i-1)//6, column=(i-1)%6, sticky='w')
             self.courts[i] = v
             self.config_widgets.append(cb)
+            self.hot_widgets.append(cb)
             # 追踪并记录日志与持久化
             v.trace_add('write', lambda *args, idx=i, var=v: self.save_and_log_change(f'场地:{idx}', bool(var.get())))
 
@@ -340,16 +2400,19 @@ class App(tk.Tk):
             cb.grid(row=j//5, column=j%5, sticky='w')
             self.slots[s] = v
             self.config_widgets.append(cb)
+            self.hot_widgets.append(cb)
             v.trace_add('write', lambda *args, ss=s, var=v: self.save_and_log_change(f'时段:{ss}', bool(var.get())))
 
         # 参数输入
         row = 5
-        for key, dv in [('刷新间隔(s)','5'),('最大重试次数','10')]:
+        for key, dv in [('刷新间隔(s)','5'),('最大重试次数','10'),('内存上限(MB)','1500'),('内存增速上限(MB/h)','300'),('句柄数上限','0'),('全局每分钟请求上限','0'),('放号时间',''),('抢刷次数','5'),('抢刷间隔(ms)','200'),('预热会话数','0'),('预热时段',''),('集群数据库',''),('轮换账号及密码',''),('标签页数','1'),('通知时限(s)','60'),('其他场馆','')]:
             ttk.Label(main, text=key).grid(row=row, column=0, sticky='e')
             var = tk.StringVar(value=self.cfg.get(key, dv))
-            e = ttk.Entry(main, textvariable=var); e.grid(row=row, column=1, sticky='we')
+            e = ttk.Entry(main, textvariable=var, show='*' if '密码' in key else None); e.grid(row=row, column=1, sticky='we')
             self.entries[key] = var
             self.config_widgets.append(e)
+            if key == '刷新间隔(s)':
+                self.hot_widgets.append(e)
             var.trace_add('write', lambda *args, k=key, v=var: self.save_and_log_change(k, v.get()))
             row += 1
         for key, dv in [('SMTP服务器',''),('端口','587'),('邮箱',''),('SMTP密码',''),('收件','')]:
@@ -358,6 +2421,8 @@ class App(tk.Tk):
             e = ttk.Entry(main, textvariable=var, show='*' if '密码' in key else None); e.grid(row=row, column=1, sticky='we')
             self.entries[key] = var
             self.config_widgets.append(e)
+            if key == '收件':
+                self.hot_widgets.append(e)
             var.trace_add('write', lambda *args, k=key, v=var: self.save_and_log_change(k, v.get()))
             row += 1
 
@@ -370,6 +2435,30 @@ class App(tk.Tk):
         self.debug.trace_add('write', lambda *args: self.save_and_log_change('调试模式', bool(self.debug.get())))
         row += 1
 
+        # 页面内监听模式：注入脚本在页内拉取/观察面板变化，不再每轮整页刷新
+        self.watch_mode = tk.BooleanVar(value=self.cfg.get('页内监听模式', False))
+        watch_cb = ttk.Checkbutton(main, text='页内监听模式（页面保持加载，仅页内拉取/观察变化）', variable=self.watch_mode)
+        watch_cb.grid(row=row, column=0, columnspan=2, sticky='w', pady=(0,2))
+        self.config_widgets.append(watch_cb)
+        self.watch_mode.trace_add('write', lambda *args: self.save_and_log_change('页内监听模式', bool(self.watch_mode.get())))
+        row += 1
+
+        # 直连 CDP 模式：刷新与读取直接走 DevTools WebSocket，不经过 chromedriver
+        self.cdp_mode = tk.BooleanVar(value=self.cfg.get('直连CDP模式', False))
+        cdp_cb = ttk.Checkbutton(main, text='直连CDP模式（刷新/读取不经过 chromedriver，需 websocket-client）', variable=self.cdp_mode)
+        cdp_cb.grid(row=row, column=0, columnspan=2, sticky='w', pady=(0,2))
+        self.config_widgets.append(cdp_cb)
+        self.cdp_mode.trace_add('write', lambda *args: self.save_and_log_change('直连CDP模式', bool(self.cdp_mode.get())))
+        row += 1
+
+        # 记录页面快照（压缩去重存盘，可用 --replay 离线回放）
+        self.record = tk.BooleanVar(value=self.cfg.get('记录快照', False))
+        record_cb = ttk.Checkbutton(main, text='记录页面快照（用于离线回放/回归测试）', variable=self.record)
+        record_cb.grid(row=row, column=0, columnspan=2, sticky='w', pady=(0,2))
+        self.config_widgets.append(record_cb)
+        self.record.trace_add('write', lambda *args: self.save_and_log_change('记录快照', bool(self.record.get())))
+        row += 1
+
         # 添加验证码输入框
         ttk.Label(main, text='验证码').grid(row=row, column=0, sticky='e')
         self.verification_code_entry = ttk.Entry(main)
@@ -380,8 +2469,18 @@ class App(tk.Tk):
         ttk.Label(main, text='非校园网用户需要填写验证码，点击”启动“即可获取验证码，退出填入即可', foreground='gray').grid(row=row, column=1, columnspan=2, sticky='we')
         row += 1
         # 启动按钮
-        self.start_button = ttk.Button(main, text='启动', command=self.start)
-        self.start_button.grid(row=row, column=0, columnspan=2, pady=(5,2))
+        btn_f = ttk.Frame(main); btn_f.grid(row=row, column=0, columnspan=2, pady=(5,2))
+        self.start_button = ttk.Button(btn_f, text='启动', command=self.start)
+        self.start_button.grid(row=0, column=0, padx=5)
+        # 运行中修改场地/时段/间隔/收件后点击，下一轮检查生效，无需重启浏览器
+        self.apply_button = ttk.Button(btn_f, text='应用配置', command=self.apply_live_config, state='disabled')
+        self.apply_button.grid(row=0, column=1, padx=5)
+        # 运行中开关采样分析，无需重启；POSIX 下也可 kill -USR1 <pid>，Windows 下 Ctrl+Break
+        self.profile_button = ttk.Button(btn_f, text='开始性能采样', command=self.toggle_profiler)
+        self.profile_button.grid(row=0, column=2, padx=5)
+        sig = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+        if sig is not None:
+            signal.signal(sig, lambda *args: self.after(0, self.toggle_profiler))
         row += 1
         # 状态框
         status_f = ttk.LabelFrame(main, text='状态信息', padding=5)
@@ -394,25 +2493,153 @@ class App(tk.Tk):
         sb = ttk.Scrollbar(status_f, command=self.status.yview)
         sb.grid(row=0, column=1, sticky='ns')
         self.status.config(yscrollcommand=sb.set)
+        # 状态栏：熔断器状态与运行指标
+        self.status_line = tk.StringVar(value='')
+        ttk.Label(status_f, textvariable=self.status_line, foreground='gray').grid(row=1, column=0, columnspan=2, sticky='w')
+        self._refresh_status_line()
         # 日志初始化
         setup_logging(self.status)
+        # 实时看板（放在右侧，占满配置区与状态框的高度）
+        self.build_dashboard(main, rowspan=row + 1)
         # 版权信息
         row += 1
         ttk.Label(main, text='© 2025 NEU 监控助手', font=('微软雅黑', 12)).grid(row=row, column=0, columnspan=2, pady=(5,0))
 
+    # 实时看板：场地×时段热力图 + 检查延迟/每分钟检查数迷你折线图。
+    # 单元格只创建一次，定时 tick 仅在数据版本变化时重绘，且只修改状态变化的单元格
+    def build_dashboard(self, main, rowspan):
+        dash_f = ttk.LabelFrame(main, text='实时看板', padding=5)
+        dash_f.grid(row=0, column=2, rowspan=rowspan, sticky='n', padx=(10,0))
+        c = HEATMAP_CELL
+        left, top = 24, 50
+        width = left + c * len(DEFAULT_SLOTS) + 4
+        self.heatmap = tk.Canvas(dash_f, width=width, height=top + c * 12 + 4, highlightthickness=0)
+        self.heatmap.grid(row=0, column=0)
+        for j, s in enumerate(DEFAULT_SLOTS):
+            self.heatmap.create_text(left + j * c + c / 2, top - 2, text=s[:5], angle=90, anchor='w', font=('TkDefaultFont', 7))
+        self.heat_cells = {}
+        for i in range(1, 13):
+            self.heatmap.create_text(left - 4, top + (i - 1) * c + c / 2, text=str(i), anchor='e', font=('TkDefaultFont', 7))
+            for j, s in enumerate(DEFAULT_SLOTS):
+                x, y = left + j * c, top + (i - 1) * c
+                self.heat_cells[(i, s)] = self.heatmap.create_rectangle(x, y, x + c - 1, y + c - 1, fill='#eeeeee', outline='')
+        self.heat_drawn = {}  # 已绘制的单元格状态
+        self.heat_version = -1
+        self.spark_w, self.spark_h = width, 36
+        self.sparks = {}
+        for row, (key, title) in enumerate([('latency', '检查延迟'), ('rate', '每分钟检查数')], start=1):
+            var = tk.StringVar(value=f'{title}: -')
+            ttk.Label(dash_f, textvariable=var, foreground='gray').grid(row=row * 2 - 1, column=0, sticky='w', pady=(6,0))
+            cv = tk.Canvas(dash_f, width=self.spark_w, height=self.spark_h, highlightthickness=0, background='white')
+            cv.grid(row=row * 2, column=0)
+            line = cv.create_line(0, self.spark_h, 0, self.spark_h, fill='#1f77b4')
+            self.sparks[key] = (cv, line, var, title)
+        self._refresh_dashboard()
+
+    def _refresh_dashboard(self):
+        version, grid, latencies, check_times = live_stats.snapshot()
+        if version != self.heat_version:
+            self.heat_version = version
+            colors = {(True, 'avail'): '#2ca02c', (True, 'full'): '#d62728', (False, 'avail'): '#a6dba0', (False, 'full'): '#f4b6b6'}
+            selected_slots = {s for s, v in self.slots.items() if v.get()}
+            for key, item in self.heat_cells.items():
+                state = (grid.get(key), key[1] in selected_slots and self.courts[key[0]].get())
+                if self.heat_drawn.get(key) != state:
+                    self.heat_drawn[key] = state
+                    # 未勾选的场地/时段用浅色显示
+                    self.heatmap.itemconfig(item, fill=colors.get((state[1], state[0]), '#eeeeee'))
+            # 每分钟检查数：按检查完成时间分钟分桶
+            rate = {}
+            for t in check_times:
+                rate[int(t // 60)] = rate.get(int(t // 60), 0) + 1
+            rates = [rate[k] for k in sorted(rate)]
+            self._draw_spark('latency', latencies, f'{latencies[-1]:.2f}s' if latencies else '-')
+            self._draw_spark('rate', rates, str(rates[-1]) if rates else '-')
+        self.after(DASHBOARD_TICK_MS, self._refresh_dashboard)
+
+    def _draw_spark(self, key, values, latest):
+        cv, line, var, title = self.sparks[key]
+        var.set(f'{title}: {latest}')
+        if len(values) < 2:
+            return
+        top = max(values) or 1
+        step = self.spark_w / (len(values) - 1)
+        coords = []
+        for k, v in enumerate(values):
+            coords += [k * step, self.spark_h - 2 - (self.spark_h - 4) * v / top]
+        cv.coords(line, *coords)
+
+    def _refresh_status_line(self):
+        m = metrics.snapshot()
+        self.status_line.set(
+            f'熔断器: {m.get("熔断器", "-")}  连续失败: {m.get("连续失败", 0)}  '
+            f'检查: {m.get("检查次数", 0)}  失败: {m.get("失败次数", 0)}  熔断: {m.get("熔断次数", 0)}  '
+            f'卡死: {m.get("卡死次数", 0)}' + (f'  集群节点: {m["集群"]}' if '集群' in m else '')
+            + (f'  可用账号: {m["账号"]}' if '账号' in m else '')
+            + (f'  通知延迟: {m["通知延迟"]}  超时: {m.get("通知超时次数", 0)}' if '通知延迟' in m else '')
+        )
+        self.after(1000, self._refresh_status_line)
+
+    def toggle_profiler(self):
+        self.sampler.toggle()
+        self.profile_button.config(text='停止性能采样' if self.sampler.running else '开始性能采样')
+
     def start(self):
         for w in self.config_widgets:
-            w.config(state='disabled')
+            if w not in self.hot_widgets:
+                w.config(state='disabled')
         self.start_button.config(state='disabled')
         threading.Thread(target=self._run_monitor, daemon=True).start()
 
+    # 启动失败时恢复配置控件与启动按钮
+    def _enable_config(self):
+        for w in self.config_widgets:
+            w.config(state='normal')
+        self.start_button.config(state='normal')
+
+    # 热更新：把当前界面上的场地/时段/间隔/收件整体替换到运行中的监控线程
+    def apply_live_config(self):
+        if self.live_params is None:
+            return
+        try:
+            base_interval = float(self.entries['刷新间隔(s)'].get())
+            if base_interval <= 0:
+                raise ValueError
+        except ValueError:
+            logging.error('刷新间隔必须是正数，未应用配置')
+            return
+        mail_cfg = list(self.monitor_params['mail_cfg'])
+        mail_cfg[4] = self.entries['收件'].get()
+        changes = {
+            'courts': [i for i, v in self.courts.items() if v.get()],
+            'slots': [s for s, v in self.slots.items() if v.get()],
+            'base_interval': base_interval,
+            'mail_cfg': mail_cfg
+        }
+        if self.cluster:
+            self.cluster.courts = changes['courts']
+        # 同步到 monitor_params，之后的自动重启也沿用新配置
+        self.monitor_params.update(changes)
+        self.live_params.update(**changes)
+        logging.info('配置已提交，将在下一轮检查时生效')
+
     def _run_monitor(self):
         # entries 中现在保存的是 StringVar，使用 get() 获取
         cfg = {k: v.get() for k, v in self.entries.items()}
         cfg.update({f'场地:{i}': v.get() for i, v in self.courts.items()})
         cfg.update({f'时段:{s}': v.get() for s, v in self.slots.items()})
         cfg['调试模式'] = self.debug.get()
+        cfg['页内监听模式'] = self.watch_mode.get()
+        cfg['直连CDP模式'] = self.cdp_mode.get()
+        cfg['记录快照'] = self.record.get()
         save_config(cfg)
+        # 登录前先校验数值/时间配置，填写有误时不启动浏览器
+        try:
+            opts = parse_options(cfg)
+        except ValueError as e:
+            logging.error(f'{e}，请检查后重试')
+            self._enable_config()
+            return
         logging.info('开始监控')
         # 初始化浏览器并登录（在启动时需要验证码可能已填入）
         self.driver = init_driver(self.debug.get())
@@ -421,53 +2648,228 @@ class App(tk.Tk):
             login_and_open_panel(self.driver, self.url, cfg['用户名'], cfg['登录密码'], verification_code)
         except Exception:
             logging.error('用户名和密码错误，或者登录失败，请检查后重试')
-            for w in self.config_widgets:
-                w.config(state='normal')
-            self.start_button.config(state='normal')
+            self._enable_config()
             return
 
         # 准备监控参数，保存以便后续重启复用
-        mail_cfg = [cfg['SMTP服务器'], int(cfg['端口']), cfg['邮箱'], cfg['SMTP密码'], cfg['收件']]
+        mail_cfg = [cfg['SMTP服务器'], opts['端口'], cfg['邮箱'], cfg['SMTP密码'], cfg['收件']]
         courts = [i for i, v in self.courts.items() if v.get()]
         slots = [s for s, v in self.slots.items() if v.get()]
-        base_interval = float(cfg['刷新间隔(s)'])
-        max_retry = int(cfg['最大重试次数'])
+        base_interval = opts['刷新间隔(s)']
+        max_retry = opts['最大重试次数']
+        mem_limit = opts['内存上限(MB)']
+        mem_growth = opts['内存增速上限(MB/h)']
+        handle_limit = opts['句柄数上限']
+        if cfg['其他场馆'].strip() and (cfg['页内监听模式'] or cfg['直连CDP模式'] or opts['标签页数'] > 1):
+            logging.warning('多场馆模式下逐个场馆导航读取，不使用页内监听/直连CDP/多标签页')
+        if cfg['页内监听模式'] and opts['标签页数'] > 1:
+            logging.warning('页内监听模式下页面自行拉取，不使用多标签页')
+        if websocket is None and cfg['直连CDP模式']:
+            logging.warning('未安装 websocket-client，直连 CDP 模式不可用，使用 WebDriver（pip install websocket-client）')
+        if psutil is None and (mem_limit or mem_growth or handle_limit):
+            logging.warning('未安装 psutil，Chrome 内存看门狗不可用（pip install psutil）')
+        if psutil is None and os.name != 'nt':
+            logging.warning('未安装 psutil，卡死恢复时可能无法结束 Chrome 子进程（pip install psutil）')
+        self.watchdog = ChromeWatchdog(mem_limit, mem_growth, handle_limit) if psutil and (mem_limit or mem_growth or handle_limit) else None
+        notify_latency.sla = opts['通知时限(s)']
+        rate_limit = opts['全局每分钟请求上限']
+        self.limiter = SharedTokenBucket(rate_limit, f'{cfg["用户名"]}@{os.getpid()}') if rate_limit > 0 else None
+        release_times = opts['放号时间']
+        self.strike = StrikeScheduler(self.url, release_times, opts['抢刷次数'], opts['抢刷间隔(ms)'], self.limiter) if release_times else None
+        pool_size = opts['预热会话数']
+        if pool_size > 0 and self.pool is None:
+            self.pool = SessionPool(pool_size, self._login_session, opts['预热时段'], self.limiter)
+            self.pool.start()
         self.monitor_params = {
             'courts': courts,
             'slots': slots,
             'base_interval': base_interval,
             'max_retry': max_retry,
-            'mail_cfg': mail_cfg
+            'mail_cfg': mail_cfg,
+            'watch_mode': bool(cfg['页内监听模式']),
+            'cdp': bool(cfg['直连CDP模式']) and websocket is not None,
+            'tabs': opts['标签页数'],
+            'venues': [kw.strip() for kw in cfg['其他场馆'].replace('，', ',').split(',') if kw.strip()],
+            'record': bool(cfg['记录快照'])
         }
 
+        if cfg['集群数据库'].strip() and self.cluster is None:
+            self.cluster = ClusterCoordinator(cfg['集群数据库'].strip(), base_interval, courts)
+            self.cluster.tick()
+            self.cluster.start()
+            logging.info(f'已加入监控集群 {cfg["集群数据库"].strip()}（节点 {self.cluster.node_id}）')
+
+        extra_accounts = parse_accounts(cfg['轮换账号及密码'])
+        if extra_accounts and self.rotation is None:
+            self.rotation = AccountRotation(cfg['用户名'], extra_accounts, self._account_session, self._make_source, base_interval)
+            self.rotation.start()
+            logging.info(f'多账号轮换：共 {len(extra_accounts) + 1} 个账号，后台登录中')
+
+        self.live_params = LiveParams(self.monitor_params)
+        self.apply_button.config(state='normal')
+        if self.supervisor is None:
+            self.supervisor = threading.Thread(target=self._supervise, name='supervisor', daemon=True)
+            self.supervisor.start()
+
         # 确保旧的 stop_event 被清除
         self._stop_event = threading.Event()
+        # 启动监控线程
+        self._start_monitor_thread()
+
+        # 安排 3 小时后触发重登录（使用 after 安排在主线程，实际重登录在单独线程执行）
+        self.after(RELOGIN_INTERVAL, lambda: threading.Thread(target=self._perform_restart, daemon=True).start())
+
+    def _start_monitor_thread(self):
+        params = self.monitor_params
+        self.heartbeat = Heartbeat()
         # driver_getter 让监控线程在每次循环读取最新的 self.driver（这样 restart 会替换 self.driver）
         def driver_getter():
             return self.driver
-
-        # 启动监控线程
+        source = self.rotation or self._make_source()
+        if params.get('record'):
+            if self.recorder is None:
+                self.recorder = SnapshotRecorder()
+            source = RecordingSource(source, self.recorder)
+        if self.cluster:
+            source = ClusterSource(source, self.cluster, self.limiter, self._stop_event, self.heartbeat)
         self.monitor_thread = threading.Thread(
-            target=monitor_slots,
-            args=(driver_getter, courts, slots, base_interval, max_retry, mail_cfg, self._stop_event),
+            target=monitor_slots, name='monitor',
+            args=(driver_getter, params['courts'], params['slots'], params['base_interval'], params['max_retry'], params['mail_cfg'], self._stop_event),
+            kwargs={'source': source, 'between_checks': self._between_checks, 'limiter': self.limiter, 'strike': self.strike, 'stats': live_stats, 'live_params': self.live_params, 'state_file': STATE_FILE, 'heartbeat': self.heartbeat, 'cluster': self.cluster, 'slot_stats': self.slot_stats, 'latency': notify_latency},
             daemon=True
         )
         self.monitor_thread.start()
 
-        # 安排 3 小时后触发重登录（使用 after 安排在主线程，实际重登录在单独线程执行）
-        self.after(RELOGIN_INTERVAL, lambda: threading.Thread(target=self._perform_restart, daemon=True).start())
+    # 按配置创建页面数据源：多场馆 > 页内监听 > 直连 CDP > WebDriver；多标签页时每个标签页一个
+    def _make_source(self):
+        params = self.monitor_params
+        if params.get('venues'):
+            return VenueSource(self.url, params['venues'])
+        if params.get('watch_mode'):
+            return PageWatcherSource()
+        factory = CdpSource if params.get('cdp') else WebDriverSource
+        if params.get('tabs', 1) > 1:
+            return TabRotationSource(self.url, params['tabs'], factory)
+        return factory()
+
+    # 监控线程在两次检查之间调用：此时没有页面操作进行中，适合回收浏览器
+    def _between_checks(self, d):
+        if self.watchdog is None:
+            return
+        reason = self.watchdog.check(d)
+        if reason:
+            self._recycle_driver(reason)
+
+    # 新建一个已登录的会话：优先取预热池中的热会话，否则完整登录（读取最新配置）
+    def _new_session(self):
+        d = self.pool.acquire() if self.pool else None
+        if d is not None:
+            return d
+        return self._login_session()
+
+    def _login_session(self):
+        cfg = load_config()
+        d = init_driver(self.debug.get())
+        try:
+            login_and_open_panel(d, self.url, cfg.get('用户名',''), cfg.get('登录密码',''))
+        except Exception:
+            d.quit()
+            raise
+        return d
+
+    # 轮换账号登录（每个账号单独缓存会话）
+    def _account_session(self, user, pwd):
+        d = init_driver(self.debug.get())
+        try:
+            login_and_open_panel(d, self.url, user, pwd, session_file=account_session_file(user))
+        except Exception:
+            d.quit()
+            raise
+        return d
+
+    # 原地回收浏览器：关闭旧进程树并重新登录，监控线程不中断（由监控线程自身调用）
+    def _recycle_driver(self, reason):
+        logging.warning(f'回收浏览器: {reason}')
+        old, self.driver = self.driver, None
+        try:
+            if old:
+                # 关闭前保存最新的 Cookie，重新登录时可直接复用
+                cache_session(old, load_config().get('用户名', ''))
+                quit_driver(old)
+        except Exception as e:
+            logging.warning(f'关闭旧浏览器时发生异常: {e}')
+        try:
+            self.driver = self._new_session()
+            logging.info('浏览器回收完成')
+        except Exception as e:
+            logging.error(f'回收后重新登录失败，转为完整重启: {e}')
+            self.restart()
+        if self.watchdog:
+            self.watchdog.reset()
+
+    # 看护线程：监控线程超过预定时间未报心跳（WebDriver 调用卡死）时，强制结束浏览器进程树并重启监控
+    def _supervise(self):
+        while True:
+            time.sleep(SUPERVISOR_TICK)
+            stalled = self.heartbeat.overdue()
+            if stalled and self._restart_lock.acquire(blocking=False):
+                try:
+                    self._recover_stall(*stalled)
+                finally:
+                    self._restart_lock.release()
+
+    def _recover_stall(self, stage, duration):
+        metrics.inc('卡死次数')
+        metrics.set('最近卡死时长(s)', round(duration, 1))
+        logging.error(f'监控线程在“{stage}”阶段已 {duration:.0f}s 无响应，强制重启浏览器与监控')
+        try:
+            new_file = not os.path.exists(STALL_HISTORY_FILE)
+            with open(STALL_HISTORY_FILE, 'a', encoding='utf-8') as f:
+                if new_file:
+                    f.write('time,stage,duration_s\n')
+                f.write(f'{datetime.now().strftime("%Y-%m-%d %H:%M:%S")},{stage},{duration:.1f}\n')
+        except OSError as e:
+            logging.warning(f'写入卡死记录失败: {e}')
+        # 旧线程醒来后看到停止信号即退出
+        self._stop_event.set()
+        if self.rotation and not self.rotation.current.primary:
+            # 卡在轮换账号的浏览器上：只处理该账号，主浏览器不受影响
+            self.rotation.abandon_current()
+            self._stop_event = threading.Event()
+            self._start_monitor_thread()
+            logging.info('卡死恢复完成（轮换账号），监控已重启')
+            return
+        old, self.driver = self.driver, None
+        if old:
+            kill_driver_tree(old)
+        try:
+            self.driver = self._new_session()
+        except Exception as e:
+            logging.error(f'卡死恢复时重新登录失败，{STALL_TIMEOUT}s 后重试: {e}')
+            self.heartbeat = Heartbeat()
+            return
+        self._stop_event = threading.Event()
+        self._start_monitor_thread()
+        logging.info('卡死恢复完成，监控已重启')
 
     def _perform_restart(self):
+        with self._restart_lock:
+            self._do_restart()
+
+    def _do_restart(self):
         logging.info('开始 3 小时到期自动重登录流程')
+        # 重登录期间暂停卡死判定
+        self.heartbeat.beat('自动重登录', STALL_TIMEOUT * 3)
         # 首先通知监控线程停止
         self._stop_event.set()
         # 给监控线程一点时间退出（非阻塞等待）
         time.sleep(1.0)
 
-        # 关闭旧浏览器
+        # 关闭旧浏览器（超时则强制结束进程树），关闭前保存最新的 Cookie
         try:
             if self.driver:
-                self.driver.quit()
+                cache_session(self.driver, load_config().get('用户名', ''))
+                quit_driver(self.driver)
         except Exception as e:
             logging.warning(f'关闭旧浏览器时发生异常: {e}')
         self.driver = None
@@ -475,11 +2877,11 @@ class App(tk.Tk):
         # 重新初始化浏览器并登录（不使用验证码输入框）
         try:
             # 读取最新配置（可能用户在运行时修改了）
-            cfg = load_config()
             logging.info('执行自动重登录（3小时）')
-            self.driver = init_driver(self.debug.get())
-            login_and_open_panel(self.driver, self.url, cfg.get('用户名',''), cfg.get('登录密码',''))
+            self.driver = self._new_session()
             logging.info('自动重登录成功')
+            if self.watchdog:
+                self.watchdog.reset()
         except Exception as e:
             logging.error(f'自动重登录失败: {e}')
             # 如果重登录失败，保留 stop_event 为已设置，稍后可以手动重启
@@ -488,15 +2890,7 @@ class App(tk.Tk):
         # 重置 stop_event 并重启监控线程（复用之前保存的监控参数）
         self._stop_event = threading.Event()
         if self.monitor_params:
-            params = self.monitor_params
-            def driver_getter():
-                return self.driver
-            self.monitor_thread = threading.Thread(
-                target=monitor_slots,
-                args=(driver_getter, params['courts'], params['slots'], params['base_interval'], params['max_retry'], params['mail_cfg'], self._stop_event),
-                daemon=True
-            )
-            self.monitor_thread.start()
+            self._start_monitor_thread()
             logging.info('重启监控线程完成')
 
         # 再次安排下一个 3 小时重登录
@@ -513,10 +2907,355 @@ class App(tk.Tk):
             self._stop_event.set()
             if self.driver:
                 self.driver.quit()
+            if self.recorder:
+                self.recorder.close()
+            if self.pool:
+                self.pool.close()
+            if self.cluster:
+                self.cluster.stop()
+            if self.rotation:
+                self.rotation.close()
+            self.sampler.stop()
         except Exception:
             pass
         self.destroy()
         sys.exit(0)
 
+# 离线回放：把录制的快照按原顺序送入 monitor_slots 的解析/比对/通知流程（不启动浏览器、不联网、不发邮件）
+def replay(paths, profile=False):
+    cfg = load_config()
+    courts = [i for i in range(1, 13) if cfg.get(f'场地:{i}', True)]
+    slots = [s for j, s in enumerate(DEFAULT_SLOTS) if cfg.get(f'时段:{s}', j<3)]
+    stop_event = threading.Event()
+    source = ReplaySource(paths, stop_event)
+    notices = []
+    def notifier(sub, body, *mail_cfg):
+        notices.append(sub)
+    args = (lambda: 'replay', courts, slots, 0, int(cfg.get('最大重试次数', 10)), [], stop_event)
+    # 回放不退避、不熔断
+    breaker = CircuitBreaker(threshold=float('inf'), backoff_base=0)
+    start = time.perf_counter()
+    if profile:
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        prof.runcall(monitor_slots, *args, source=source, notifier=notifier, breaker=breaker)
+    else:
+        monitor_slots(*args, source=source, notifier=notifier, breaker=breaker)
+    elapsed = time.perf_counter() - start
+    print(f'回放 {source.count} 个快照，触发通知 {len(notices)} 次，耗时 {elapsed:.3f}s'
+          f'（{source.count / elapsed if elapsed else 0:.0f} 快照/s）')
+    for sub in notices[:20]:
+        print(f'  {sub}')
+    if len(notices) > 20:
+        print(f'  ...（其余 {len(notices) - 20} 条省略）')
+    if profile:
+        pstats.Stats(prof).sort_stats('cumulative').print_stats(25)
+
+# 传输开销对比：本地合成面板页面上分别用 WebDriver 与直连 CDP 刷新+读取 n 次，输出每轮耗时分位数
+def bench_transport(n, debug=False):
+    page = os.path.join(tempfile.gettempdir(), 'neu_monitor_bench.html')
+    panel = '<div class="selectList sectionNotes"><div class="TimeDiv"><ul>' + ''.join(
+        f'<li>{s} 可用</li>' for s in DEFAULT_SLOTS) + '</ul></div></div>'
+    with open(page, 'w', encoding='utf-8') as f:
+        f.write('<html><head><meta charset="utf-8"></head><body>' + panel * 12 + '</body></html>')
+    d = init_driver(debug)
+    try:
+        d.get('file:///' + page.replace(os.sep, '/').lstrip('/'))
+        sources = [('WebDriver', WebDriverSource())]
+        if websocket is not None:
+            sources.append(('CDP', CdpSource()))
+        else:
+            print('未安装 websocket-client，仅测试 WebDriver')
+        for name, source in sources:
+            refresh_ms, read_ms = [], []
+            for k in range(n + 3):
+                t0 = time.perf_counter()
+                source.refresh(d)
+                t1 = time.perf_counter()
+                panels = source.read_panels(d)
+                t2 = time.perf_counter()
+                assert len(panels) == 12
+                if k >= 3:  # 前 3 轮预热（建立连接等）
+                    refresh_ms.append((t1 - t0) * 1000)
+                    read_ms.append((t2 - t1) * 1000)
+            for label, xs in [('刷新', refresh_ms), ('读取', read_ms)]:
+                xs.sort()
+                print(f'{name:>9} {label}: 中位 {xs[len(xs) // 2]:.2f}ms  p90 {xs[int(len(xs) * 0.9)]:.2f}ms  最大 {xs[-1]:.2f}ms')
+            if hasattr(source, 'close'):
+                source.close()
+    finally:
+        quit_driver(d)
+
+# 压力测试用的本地模拟站点：场馆目录页（一个预约按钮）与 12 个场地的面板页，每次请求随机生成可用时段
+class _MockSiteHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/booking/page/selectPeList'):
+            html = '<button class="reserve_button" onclick="location.href=\'/panel\'">预约</button>'
+        elif self.path.startswith('/panel'):
+            html = ''.join('<div class="selectList sectionNotes"><div class="TimeDiv"><ul>' + ''.join(
+                f'<li>{s} {"可用" if random.random() < SOAK_AVAIL_PROB else "已满"}</li>' for s in DEFAULT_SLOTS)
+                + '</ul></div></div>' for _ in range(12))
+        else:
+            self.send_error(404)
+            return
+        body = f'<html><head><meta charset="utf-8"></head><body>{html}</body></html>'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# 压力测试任务的熔断器：额外累计全部失败次数，用于计算每个任务的错误率
+class _SoakBreaker(CircuitBreaker):
+    def __init__(self):
+        super().__init__()
+        self.errors = 0
+
+    def record_failure(self, err):
+        self.errors += 1
+        return super().record_failure(err)
+
+# 浏览器进程树的 RSS（MB），无 psutil 时返回 None
+def driver_rss_mb(d):
+    if psutil is None:
+        return None
+    try:
+        root = psutil.Process(d.service.process.pid)
+        procs = [root] + root.children(recursive=True)
+    except Exception:
+        return None
+    rss = 0
+    for p in procs:
+        try:
+            rss += p.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return rss / (1024 * 1024)
+
+# 压力测试：对本地模拟站点逐级增加并发监控任务（每个任务一个浏览器 + 一个 monitor_slots 线程），
+# 每级运行 step 秒，统计检查延迟分位数、检查速率、错误率、CPU 与内存，输出容量报告（logs/soak_*.csv）
+def soak(levels, step=60, interval=2.0, debug=False):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _MockSiteHandler)
+    threading.Thread(target=server.serve_forever, name='mock-site', daemon=True).start()
+    panel_url = f'http://127.0.0.1:{server.server_port}/panel'
+    with open(os.path.abspath(__file__), 'rb') as f:
+        version = hashlib.sha1(f.read()).hexdigest()[:10]
+    print(f'压力测试：版本 {version}，CPU {os.cpu_count()} 核'
+          + (f'，内存 {psutil.virtual_memory().total / 2**30:.1f}GB' if psutil else '（未安装 psutil，不统计 CPU/内存）')
+          + f'，检查间隔 {interval}s，每级 {step}s，模拟站点 {panel_url}')
+    jobs = []  # [(driver, stop_event, breaker, stats)]
+    rows, baseline_p90 = [], None
+    courts = list(range(1, 13))
+    try:
+        for m in levels:
+            while len(jobs) < m:
+                d = init_driver(debug)
+                d.get(panel_url)
+                stop_event, breaker, stats = threading.Event(), _SoakBreaker(), LiveStats(int(step / interval * 2) + 100)
+                threading.Thread(target=monitor_slots, name=f'soak-{len(jobs) + 1}', daemon=True,
+                                 args=(lambda d=d: d, courts, DEFAULT_SLOTS, interval, 10 ** 9, [], stop_event),
+                                 kwargs={'notifier': lambda *args: None, 'breaker': breaker, 'stats': stats}).start()
+                jobs.append((d, stop_event, breaker, stats))
+            errors0 = [job[2].errors for job in jobs]
+            if psutil:
+                psutil.cpu_percent(None)
+            start = time.time()
+            time.sleep(step)
+            elapsed = time.time() - start
+            latencies, job_p90, checks = [], [], 0
+            for d, _, _, stats in jobs:
+                _, _, lats, times = stats.snapshot()
+                window = sorted(lat for lat, t in zip(lats, times) if t >= start)
+                checks += len(window)
+                latencies += window
+                if window:
+                    job_p90.append(window[int(len(window) * 0.9)])
+            errors = sum(job[2].errors for job in jobs) - sum(errors0)
+            latencies.sort()
+            pct = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else float('nan')
+            rss = [driver_rss_mb(job[0]) for job in jobs]
+            row = {
+                'jobs': m,
+                'checks_per_s': round(checks / elapsed, 2),
+                'expected_per_s': round(m / interval, 2),
+                'p50_s': round(pct(0.5), 3),
+                'p90_s': round(pct(0.9), 3),
+                'p99_s': round(pct(0.99), 3),
+                'worst_job_p90_s': round(max(job_p90), 3) if job_p90 else '',
+                'error_rate': round(errors / max(checks + errors, 1), 4),
+                'cpu_pct': psutil.cpu_percent(None) if psutil else '',
+                'rss_mb': round(sum(rss), 1) if None not in rss else '',
+                'rss_per_job_mb': round(sum(rss) / m, 1) if None not in rss else '',
+                'free_mem_pct': round(psutil.virtual_memory().available / psutil.virtual_memory().total * 100, 1) if psutil else '',
+            }
+            if baseline_p90 is None:
+                baseline_p90 = row['p90_s']
+            row['ok'] = int(bool(latencies) and row['p90_s'] <= baseline_p90 * SOAK_LATENCY_FACTOR
+                            and row['error_rate'] <= SOAK_ERROR_RATE
+                            and row['checks_per_s'] >= row['expected_per_s'] * SOAK_RATE_FLOOR)
+            rows.append(row)
+            print(f'  {m:>3} 个任务：检查 {row["checks_per_s"]}/s（预期 {row["expected_per_s"]}/s），'
+                  f'延迟 p50 {row["p50_s"]}s p90 {row["p90_s"]}s p99 {row["p99_s"]}s，错误率 {row["error_rate"]:.2%}'
+                  + (f'，CPU {row["cpu_pct"]}%' if psutil else '')
+                  + (f'，RSS {row["rss_mb"]}MB（每任务 {row["rss_per_job_mb"]}MB）' if row['rss_mb'] != '' else '')
+                  + ('' if row['ok'] else '  ← 性能下降'))
+            if not row['ok']:
+                break
+            if psutil and psutil.virtual_memory().available / psutil.virtual_memory().total < SOAK_MIN_FREE_MEM:
+                print('  可用内存不足，停止加压')
+                break
+    finally:
+        for _, stop_event, _, _ in jobs:
+            stop_event.set()
+        closers = [threading.Thread(target=quit_driver, args=(job[0],), daemon=True) for job in jobs]
+        for t in closers:
+            t.start()
+        for t in closers:
+            t.join()
+        server.shutdown()
+    if not rows:
+        return
+    os.makedirs('logs', exist_ok=True)
+    path = os.path.join('logs', f'soak_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=['version', 'interval_s'] + list(rows[0]))
+        w.writeheader()
+        for row in rows:
+            w.writerow({'version': version, 'interval_s': interval, **row})
+    passed = [row['jobs'] for row in rows if row['ok']]
+    print(f'容量：本机最多约 {max(passed) if passed else 0} 个并发监控任务（检查间隔 {interval}s），报告写入 {path}')
+
+# 空档统计：读取录制的快照，按 (场地, 时段, 星期) 统计空档出现频率、开放时长占比、
+# 出现时距开场的提前量和每次开放时长分布，导出为紧凑的 CSV 表供监控启动时载入
+def analyze(paths, out=SLOT_STATS_FILE):
+    try:
+        import numpy as np
+    except ImportError:
+        print('空档统计需要 numpy：pip install numpy')
+        return
+    keys = [(i, s) for i in range(1, 13) for s in DEFAULT_SLOTS]
+    col = {k: j for j, k in enumerate(keys)}
+    K = len(keys)
+    times, rows, cache = [], [], {}
+    for p in paths:
+        for t, panels, h in load_recording(p):
+            # 按内容哈希缓存（跨文件同样有效），同一内容的快照只解析一次
+            row = cache.get(h)
+            if row is None:
+                row = np.zeros(K, dtype=bool)
+                for i, texts in enumerate(panels[:12], start=1):
+                    for text in texts:
+                        if '可用' in text:
+                            for s in DEFAULT_SLOTS:
+                                if s in text:
+                                    row[col[(i, s)]] = True
+                cache[h] = row
+            times.append(t)
+            rows.append(row)
+    if len(times) < 2:
+        print('快照数量不足，无法统计')
+        return
+    order = np.argsort(times)
+    T = np.asarray(times)[order]
+    A = np.vstack(rows)[order]
+    n = len(T)
+    # 每个快照代表到下一个快照之间的时长；超过 ANALYZE_MAX_GAP 的间隔视为监控中断
+    dt = np.diff(T, append=T[-1])
+    dt[dt > ANALYZE_MAX_GAP] = 0
+    # 本地时间的星期（周一=0）和当天秒数
+    local = T + datetime.now().astimezone().utcoffset().total_seconds()
+    days = np.floor(local / 86400)
+    wd = ((days + 3) % 7).astype(int)  # 1970-01-01 是周四
+    sod = local - days * 86400
+    onehot = np.eye(7)[wd]  # n x 7
+    observed = onehot.T @ dt  # 每个星期的观测秒数
+    open_frac = (onehot.T @ (dt[:, None] * A)) / np.maximum(observed, 1)[:, None]  # 7 x K
+
+    # 开放区间：对每列找 False->True / True->False 的位置
+    pad = np.zeros((1, K), dtype=np.int8)
+    edges = np.diff(np.vstack([pad, A.astype(np.int8), pad]), axis=0)
+    sr, sc = np.nonzero(edges == 1)
+    er, ec = np.nonzero(edges == -1)
+    so, eo = np.lexsort((sr, sc)), np.lexsort((er, ec))
+    sr, sc, er = sr[so], sc[so], er[eo]
+    dur = T[np.minimum(er, n - 1)] - T[sr]
+    fresh = sr > 0  # 录制开始时就已开放的不计为“出现”
+    group = wd[sr] * K + sc
+    appear = np.bincount(group[fresh], minlength=7 * K)
+    slot_start = np.array([int(s[:2]) * 3600 + int(s[3:5]) * 60 for _, s in keys])
+    lead_h = ((slot_start[sc] - sod[sr]) % 86400) / 3600
+
+    # 分组分位数：按 (组, 值) 排序后在组边界处切分
+    def group_quantile(g, v, q):
+        res = np.full(7 * K, np.nan)
+        if len(g):
+            o = np.lexsort((v, g))
+            gs, vs = g[o], v[o]
+            bounds = np.flatnonzero(np.diff(gs)) + 1
+            for chunk_g, chunk_v in zip(np.split(gs, bounds), np.split(vs, bounds)):
+                res[chunk_g[0]] = np.quantile(chunk_v, q)
+        return res
+
+    lead_med = group_quantile(group[fresh], lead_h[fresh], 0.5)
+    open_med = group_quantile(group, dur, 0.5)
+    open_p90 = group_quantile(group, dur, 0.9)
+    obs_days = observed / 86400
+    out_rows = []
+    for d in range(7):
+        if observed[d] <= 0:
+            continue
+        for j, (court, slot) in enumerate(keys):
+            g = d * K + j
+            if appear[g] == 0 and open_frac[d, j] == 0:
+                continue
+            out_rows.append({
+                'court': court, 'slot': slot, 'weekday': d,
+                'observed_days': round(obs_days[d], 3),
+                'appearances': int(appear[g]),
+                'per_day': round(appear[g] / obs_days[d], 3),
+                'open_frac': round(open_frac[d, j], 4),
+                'lead_h_median': '' if np.isnan(lead_med[g]) else round(lead_med[g], 2),
+                'open_s_median': 0 if np.isnan(open_med[g]) else round(open_med[g], 1),
+                'open_s_p90': 0 if np.isnan(open_p90[g]) else round(open_p90[g], 1),
+            })
+    out_rows.sort(key=lambda r: -r['per_day'])
+    fields = ['court', 'slot', 'weekday', 'observed_days', 'appearances', 'per_day', 'open_frac', 'lead_h_median', 'open_s_median', 'open_s_p90']
+    with open(out, 'w', encoding='utf-8', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=fields)
+        w.writeheader()
+        w.writerows(out_rows)
+    print(f'统计 {n} 个快照（{observed.sum() / 3600:.1f} 小时），{len(out_rows)} 条记录写入 {out}')
+    names = '一二三四五六日'
+    for r in out_rows[:15]:
+        print(f'  周{names[r["weekday"]]} 场地{r["court"]:>2} {r["slot"]}  每天出现 {r["per_day"]:.2f} 次  '
+              f'开放占比 {r["open_frac"]:.1%}  提前 {r["lead_h_median"]}h  开放中位 {r["open_s_median"]:.0f}s')
+
 if __name__ == '__main__':
-    App().mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='NEU场地监控')
+    parser.add_argument('--replay', nargs='+', metavar='FILE', help='离线回放 recordings/ 下的录制文件')
+    parser.add_argument('--profile', action='store_true', help='回放时使用 cProfile 统计热点')
+    parser.add_argument('-v', '--verbose', action='store_true', help='回放时输出逐轮日志')
+    parser.add_argument('--analyze', nargs='+', metavar='FILE', help='统计录制文件中各场地时段的空档规律')
+    parser.add_argument('--out', default=SLOT_STATS_FILE, help='空档统计输出文件')
+    parser.add_argument('--bench-transport', type=int, metavar='N', help='对比 WebDriver 与直连 CDP 的每轮刷新/读取耗时')
+    parser.add_argument('--soak', metavar='M1,M2,...', help='压力测试：依次以这些并发任务数运行，输出容量报告')
+    parser.add_argument('--soak-step', type=float, default=60, help='压力测试每级运行秒数')
+    parser.add_argument('--soak-interval', type=float, default=2.0, help='压力测试中每个任务的检查间隔（秒）')
+    opts = parser.parse_args()
+    if opts.replay:
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+        replay(opts.replay, opts.profile)
+    elif opts.analyze:
+        analyze(opts.analyze, opts.out)
+    elif opts.bench_transport:
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+        bench_transport(opts.bench_transport)
+    elif opts.soak:
+        logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+        soak([int(m) for m in opts.soak.split(',')], opts.soak_step, opts.soak_interval)
+    else:
+        App().mainloop()
\ No newline at end of file